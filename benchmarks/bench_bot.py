@@ -0,0 +1,303 @@
+"""
+Latency and peak memory of the bot on synthetic ledgers, end to end.
+
+    python benchmarks/bench_bot.py [n_transactions ...] [--runs N]
+
+Serves each synthetic ledger from fake_github.py and times, with the real
+storage, cache and handlers:
+
+- "load cold": get_entries() of a new container, no snapshot or parse cache
+- "load warm": get_entries() when the branch did not change (a 304)
+- "write": write_to_file() of a new entry, the conflict check and commit included
+- "budget report" / "account report": rendering the reports from scratch, from
+  the posting columns of the ledger
+- "trend report": the /trend table of every budget account over the whole history
+- "/add confirm": the "Yes" of an /add conversation through the Telegram
+  application, which writes the entry and sends both reports back
+
+The Bot API is answered locally, so Telegram round trips are not part of the
+numbers. Latencies are the p50/p90/p99 of the runs, peak memory is traced on
+a separate run of each step so that tracing does not slow the timed ones.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fake_github
+import synthetic  # also puts finance_bot on the path
+
+USER_ID = 5
+_state_dir = tempfile.mkdtemp(prefix="bench-bot-")
+os.environ.setdefault(
+    "SECRETS",
+    json.dumps(
+        {
+            "github_token": "benchmark",
+            "telegram_token": "1:benchmark",
+            "telegram_secret_token": "benchmark",
+            "sasha_user_id": str(USER_ID),
+        }
+    ),
+)
+os.environ["LEDGER_SNAPSHOT_DIR"] = _state_dir
+os.environ["PERSISTENCE_SQLITE_PATH"] = os.path.join(_state_dir, "persistence.sqlite3")
+os.environ.pop("PERSISTENCE_TABLE", None)
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import beancount_file  # noqa: E402
+import budget_eur  # noqa: E402
+import reports  # noqa: E402
+from columnar import PostingColumns  # noqa: E402
+from handlers import add_handlers  # noqa: E402
+from persistence import make_persistence  # noqa: E402
+from storage import RestStorage  # noqa: E402
+from webhook_reply import start_reply  # noqa: E402
+
+CHAT = {"id": USER_ID, "type": "private"}
+USER = {"id": USER_ID, "is_bot": False, "first_name": "Benchmark"}
+BOT = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "benchmark_bot"}
+
+
+class LocalBotAPI(BaseRequest):
+    """Answers every Bot API call right away, with a message where one is expected."""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        api_method = url.rsplit("/", 1)[-1]
+        if api_method == "getMe":
+            result = BOT
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = {"message_id": 1, "date": 0, "chat": CHAT, "from": BOT}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class Updates:
+    """Builds the updates of a private chat with the allowed user."""
+
+    def __init__(self):
+        self.update_id = 0
+
+    def _next(self, **update):
+        self.update_id += 1
+        return {"update_id": self.update_id, **update}
+
+    def message(self, text):
+        message = {
+            "message_id": self.update_id,
+            "date": int(time.time()),
+            "chat": CHAT,
+            "from": USER,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+            ]
+        return self._next(message=message)
+
+    def callback(self, data):
+        message = {"message_id": 1, "date": 0, "chat": CHAT, "from": BOT}
+        return self._next(
+            callback_query={
+                "id": str(self.update_id),
+                "from": USER,
+                "chat_instance": "benchmark",
+                "message": message,
+                "data": data,
+            }
+        )
+
+
+async def process(app, update):
+    # Like the Lambda handler, without the API Gateway event around it
+    start_reply()
+    await app.process_update(Update.de_json(update, app.bot))
+    await app.update_persistence()
+
+
+async def add_until_summary(app, updates, amount):
+    """Goes through an /add conversation up to the Yes/No question."""
+    today = datetime.date.today().strftime("%m-%d")
+    for update in (
+        updates.message("/add"),
+        updates.message(amount),
+        updates.callback("Expenses:Variable"),
+        updates.message("Benchmark"),
+        updates.message("Benchmark"),
+        updates.callback(today),
+        updates.callback("Groceries"),
+        updates.callback("Assets:NL:ING:Checking59"),
+    ):
+        await process(app, update)
+
+
+def reset_container():
+    """Forgets everything a container keeps between invocations."""
+    beancount_file._ledger = None
+    beancount_file._parsed_files.clear()
+    budget_eur._memo = {}
+    reports._report_cache.clear()
+    for name in os.listdir(_state_dir):
+        if name.endswith((".pickle", ".etag")):
+            os.remove(os.path.join(_state_dir, name))
+
+
+def percentile(samples, p):
+    # Nearest rank, so that p99 of few runs is the slowest one
+    ordered = sorted(samples)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+async def measure(step, runs):
+    """Returns the latencies of `runs` calls of step(), and its peak memory."""
+    latencies = []
+    for _ in range(runs):
+        prepare = await step()
+        start = time.perf_counter()
+        await prepare()
+        latencies.append(time.perf_counter() - start)
+
+    prepare = await step()
+    tracemalloc.start()
+    await prepare()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return latencies, peak
+
+
+async def bench(n_transactions, runs):
+    content = synthetic.generate_ledger(n_transactions).encode()
+    server, repository_url = fake_github.start({beancount_file.FILE_PATH: content})
+    beancount_file._storage = RestStorage(repository_url, beancount_file.BRANCH)
+
+    app = (
+        ApplicationBuilder()
+        .token(json.loads(os.environ["SECRETS"])["telegram_token"])
+        .request(LocalBotAPI())
+        .get_updates_request(LocalBotAPI())
+        .persistence(make_persistence())
+        .build()
+    )
+    add_handlers(app)
+    await app.initialize()
+    updates = Updates()
+    written = 0
+
+    # Each step does its setup and returns the coroutine function to time
+    async def load_cold():
+        reset_container()
+        return beancount_file.get_entries
+
+    async def load_warm():
+        await beancount_file.get_entries()
+        return beancount_file.get_entries
+
+    async def write():
+        nonlocal written
+        written += 1
+        await beancount_file.get_entries()
+        return lambda: beancount_file.write_to_file(
+            f'{datetime.date.today()} * "Benchmark" "Write {written}"\n'
+            f"    Expenses:Variable:Groceries {written}.00 EUR\n"
+            "    Assets:NL:ING:Checking59"
+        )
+
+    async def budget_report():
+        ledger = await beancount_file.get_ledger()
+        options = {**ledger.options, "filtered": False, "n_months_ahead": 0}
+        columns = ledger.index(PostingColumns)
+        return lambda: asyncio.to_thread(
+            reports.generate_monthly_budget_report,
+            ledger.entries,
+            options,
+            None,
+            columns,
+        )
+
+    async def account_report():
+        ledger = await beancount_file.get_ledger()
+        columns = ledger.index(PostingColumns)
+        return lambda: asyncio.to_thread(
+            reports.generate_account_report, ledger.entries, ledger.options, columns
+        )
+
+    async def trend_report():
+        ledger = await beancount_file.get_ledger()
+        columns = ledger.index(PostingColumns)
+        return lambda: asyncio.to_thread(
+            reports.generate_trend_report,
+            ledger.entries,
+            ledger.options,
+            None,
+            None,
+            columns,
+        )
+
+    async def add_confirm():
+        nonlocal written
+        written += 1
+        await add_until_summary(app, updates, f"{written}.01")
+        return lambda: process(app, updates.callback("yes"))
+
+    results = {}
+    for name, step in (
+        ("load cold", load_cold),
+        ("load warm", load_warm),
+        ("write", write),
+        ("budget report", budget_report),
+        ("account report", account_report),
+        ("trend report", trend_report),
+        ("/add confirm", add_confirm),
+    ):
+        results[name] = await measure(step, runs)
+
+    await app.shutdown()
+    server.terminate()
+    return results
+
+
+def main():
+    args = sys.argv[1:]
+    runs = 10
+    if "--runs" in args:
+        index = args.index("--runs")
+        runs = int(args[index + 1])
+        del args[index : index + 2]
+    sizes = [int(arg) for arg in args] or [1_000, 10_000, 100_000]
+
+    print(
+        "| Transactions | Step           | p50 (ms) | p90 (ms) | p99 (ms) | Peak (MB) |"
+    )
+    print(
+        "|-------------:|----------------|---------:|---------:|---------:|----------:|"
+    )
+    # One loop for every size like a container, the GitHub client is bound to it
+    loop = asyncio.new_event_loop()
+    for n_transactions in sizes:
+        results = loop.run_until_complete(bench(n_transactions, runs))
+        for name, (latencies, peak) in results.items():
+            p50, p90, p99 = (percentile(latencies, p) * 1000 for p in (50, 90, 99))
+            print(
+                f"| {n_transactions:12d} | {name:<14} | {p50:8.1f} | {p90:8.1f} "
+                f"| {p99:8.1f} | {peak / 1e6:9.1f} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
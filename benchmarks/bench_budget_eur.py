@@ -0,0 +1,61 @@
+"""
+Time the budget_eur plugin on synthetic ledgers.
+
+    python benchmarks/bench_budget_eur.py [n_transactions ...]
+
+"cold" is the first load of a container, "warm" a reload of the same history
+with the memo of the previous load, as after appending an entry.
+"""
+
+import sys
+import time
+
+from beancount.core.data import Transaction
+from beancount.parser import booking, parser
+
+import synthetic  # also puts finance_bot on the path
+
+import budget_eur
+
+
+def fresh_copy(entries):
+    # The plugin extends the postings in place, give every run its own lists
+    return [
+        (
+            entry._replace(postings=list(entry.postings))
+            if isinstance(entry, Transaction)
+            else entry
+        )
+        for entry in entries
+    ]
+
+
+def bench(n_transactions):
+    entries, _, options = parser.parse_string(synthetic.generate_ledger(n_transactions))
+    entries, _ = booking.book(entries, options)
+
+    budget_eur._memo = {}
+    timings = {}
+    for run in ("cold", "warm"):
+        run_entries = fresh_copy(entries)
+        start = time.perf_counter()
+        budget_eur.budget_eur(run_entries, options)
+        timings[run] = time.perf_counter() - start
+
+    return timings
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000]
+
+    print("| Transactions | Cold (ms) | Warm (ms) |")
+    print("|-------------:|----------:|----------:|")
+    for n_transactions in sizes:
+        timings = bench(n_transactions)
+        print(
+            f"| {n_transactions:12d} | {timings['cold'] * 1000:9.1f} | {timings['warm'] * 1000:9.1f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
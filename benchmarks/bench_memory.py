@@ -0,0 +1,113 @@
+"""
+Peak memory of reading and writing a large ledger through the contents API.
+
+    python benchmarks/bench_memory.py [megabytes]
+
+Compares the raw media blob read and streamed base64 PUT of RestStorage with
+the previous base64-in-JSON round trip of the contents API, on a synthetic
+ledger served by fake_github.py. Exits with an error if the peak of the current paths is not
+bounded by a small multiple of the file size, plus the buffers of a base64 chunk.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import sys
+import tracemalloc
+
+import fake_github
+import synthetic  # also puts finance_bot on the path
+
+os.environ.setdefault("SECRETS", json.dumps({"github_token": "benchmark"}))
+
+import github_client  # noqa: E402
+from beancount_file import _insert_entries  # noqa: E402
+from storage import BASE64_CHUNK, RestStorage  # noqa: E402
+
+# Peak allocations over the file size that the current paths must stay under:
+# the downloaded bytes and their decoded string, or the spliced string and its
+# encoded bytes
+MAX_PEAK_RATIO = 2.5
+# Plus allocations that don't grow with the file: an encoded chunk of the PUT
+# body and the copy the transport writes, which outweigh the ratio under 5 MB
+FIXED_OVERHEAD = 2 * 4 * BASE64_CHUNK // 3
+
+ENTRY = '2024-01-01 * "Benchmark" ""\n    Expenses:Variable:Groceries 1.00 EUR\n    Assets:NL:ING:Checking59'
+
+
+async def legacy_read(url):
+    response = await github_client.request("GET", url)
+    file_data = response.json()
+    return file_data["sha"], base64.b64decode(file_data["content"]).decode("utf-8")
+
+
+async def legacy_write(url, content, sha):
+    updated_content = content + f"\n{ENTRY}\n"
+    data = {
+        "message": "Benchmark",
+        "content": base64.b64encode(updated_content.encode()).decode(),
+        "sha": sha,
+    }
+    response = await github_client.request("PUT", url, idempotent=False, json=data)
+    response.raise_for_status()
+    return response.json()["content"]["sha"]
+
+
+async def current_read(storage):
+    sha = (await storage.get_tree())["files"]["main.beancount"]
+    return sha, await storage.get_blob("main.beancount", sha)
+
+
+async def current_write(storage, content, sha):
+    return await storage.put_file(
+        "main.beancount", _insert_entries(content, ENTRY), sha, "Benchmark"
+    )
+
+
+def measure(loop, coroutine):
+    tracemalloc.start()
+    result = loop.run_until_complete(coroutine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    # About 113 bytes per synthetic transaction
+    content = synthetic.generate_ledger(int(megabytes * 1e6 / 113))
+    size = len(content.encode())
+
+    server, repository_url = fake_github.start({"main.beancount": content.encode()})
+    url = f"{repository_url}/contents/main.beancount"
+    storage = RestStorage(repository_url, "main")
+    loop = asyncio.new_event_loop()
+    # Open the connection outside of the measurements
+    loop.run_until_complete(storage.get_tree())
+
+    peaks = {}
+    (sha, content), peaks["legacy read"] = measure(loop, legacy_read(url))
+    (sha, content), peaks["read"] = measure(loop, current_read(storage))
+    sha, peaks["legacy write"] = measure(loop, legacy_write(url, content, sha))
+    (sha, content), _ = measure(loop, current_read(storage))
+    sha, peaks["write"] = measure(loop, current_write(storage, content, sha))
+    server.terminate()
+
+    print(f"Ledger of {size / 1e6:.1f} MB\n")
+    print("| Path         | Peak (MB) | x file size |")
+    print("|--------------|----------:|------------:|")
+    for path, peak in peaks.items():
+        print(f"| {path:<12} | {peak / 1e6:9.1f} | {peak / size:11.2f} |")
+
+    bound = MAX_PEAK_RATIO * size + FIXED_OVERHEAD
+    unbounded = [path for path in ("read", "write") if peaks[path] > bound]
+    if unbounded:
+        sys.exit(
+            f"Peak memory above {MAX_PEAK_RATIO}x the file size "
+            f"+ {FIXED_OVERHEAD / 1e6:.1f} MB: {unbounded}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+A local stand-in for the parts of the GitHub API the bot uses, for benchmarks.
+
+    python benchmarks/fake_github.py ledger.beancount [port]
+
+Serves a repository "owner/repo" with a single branch: the recursive tree of
+the branch and the blobs of its files (JSON or raw media type), and the contents
+API for reading and committing a file. GETs honour If-None-Match, and a PUT with
+a stale blob SHA gets a 409 like on GitHub.
+"""
+
+import base64
+import hashlib
+import json
+import multiprocessing
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPOSITORY_PATH = "/repos/owner/repo"
+
+
+def blob_sha(data):
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class RepositoryHandler(BaseHTTPRequestHandler):
+    # path -> bytes of the files of the branch, shared by the requests of a server
+    files = {}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _route(self):
+        path = self.path.split("?")[0]
+        if not path.startswith(f"{REPOSITORY_PATH}/"):
+            return None, None
+        kind, _, rest = path[len(REPOSITORY_PATH) + 1 :].partition("/")
+        if kind == "git":
+            kind, _, rest = rest.partition("/")
+        return kind, rest
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_cached(self, etag, body):
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304)
+        self._send(200, body, [("ETag", etag)])
+
+    def _send_blob(self, data):
+        if "raw" in self.headers.get("Accept", ""):
+            body = data
+        else:
+            body = json.dumps(
+                {
+                    "sha": blob_sha(data),
+                    "encoding": "base64",
+                    "content": base64.encodebytes(data).decode(),
+                }
+            ).encode()
+        self._send_cached(f'W/"{blob_sha(data)}"', body)
+
+    def do_GET(self):
+        kind, rest = self._route()
+        with self.lock:
+            files = dict(self.files)
+
+        if kind == "trees":
+            tree = [
+                {"path": path, "type": "blob", "sha": blob_sha(data)}
+                for path, data in sorted(files.items())
+            ]
+            body = json.dumps({"tree": tree, "truncated": False}).encode()
+            return self._send_cached(f'W/"{hashlib.sha1(body).hexdigest()}"', body)
+
+        if kind == "blobs":
+            for data in files.values():
+                if blob_sha(data) == rest:
+                    return self._send_blob(data)
+        elif kind == "contents" and rest in files:
+            return self._send_blob(files[rest])
+
+        self._send(404)
+
+    def do_PUT(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        kind, path = self._route()
+        if kind != "contents":
+            return self._send(404)
+
+        with self.lock:
+            if request["sha"] != blob_sha(self.files.get(path, b"")):
+                return self._send(409)
+            self.files[path] = base64.b64decode(request["content"])
+            sha = blob_sha(self.files[path])
+        self._send(200, json.dumps({"content": {"sha": sha}}).encode())
+
+
+def serve(files, port=0, ready=None):
+    RepositoryHandler.files = files
+    server = ThreadingHTTPServer(("127.0.0.1", port), RepositoryHandler)
+    if ready is not None:
+        ready.put(server.server_port)
+    server.serve_forever()
+
+
+def start(files):
+    """
+    Serves the files from another process, so that it does not count towards the
+    memory or CPU of the benchmark. Returns the process and the API URL of the
+    repository.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(files, 0, ready), daemon=True)
+    process.start()
+    port = ready.get()
+    return process, f"http://127.0.0.1:{port}{REPOSITORY_PATH}"
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as f:
+        files = {"main.beancount": f.read()}
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8000
+    print(f"Serving http://127.0.0.1:{port}{REPOSITORY_PATH}")
+    serve(files, port)
@@ -0,0 +1,94 @@
+"""Synthetic beancount ledgers shaped like the real one, for benchmarks."""
+
+import datetime
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "finance_bot"))
+
+from constants import get_accounts, get_counterparties  # noqa: E402
+
+
+def generate_ledger(
+    n_transactions,
+    seed=0,
+    start=datetime.date(2015, 1, 1),
+    end=datetime.date(2025, 1, 1),
+):
+    """
+    Generate a ledger with the account tree of constants.py and the budget_eur plugin.
+
+    Every month gets a salary, a budget assignment per expense category and a
+    transfer; the rest of the transactions are EUR expenses spread over the days,
+    more of them a day for larger sizes so that the history mostly ends by `end`.
+    The file ends with the ;;; FUTURE ;;; marker that write_to_file inserts before.
+    """
+    rng = random.Random(seed)
+    accounts = list(get_accounts())
+    counterparties = get_counterparties()
+    expenses = [
+        f"{type}:{counterparty}"
+        for type in ("Expenses:Variable", "Expenses:Fixed")
+        for counterparty in counterparties[type]
+    ]
+    incomes = [f"Income:{counterparty}" for counterparty in counterparties["Income"]]
+
+    lines = [
+        'option "title" "Synthetic ledger"',
+        'option "operating_currency" "EUR"',
+        'plugin "budget_eur"',
+        "",
+        f"{start} commodity EUR",
+        f"{start} commodity BGT_EUR",
+        "",
+    ]
+    for account in accounts + expenses + incomes:
+        lines.append(f"{start} open {account}")
+    for account in ("Income:Available", "Expenses:Spent"):
+        lines.append(f"{start} open {account}")
+    lines.append("")
+
+    # At least 1 to 5 transactions a day, which keeps the dates realistic
+    max_per_day = max(5, 2 * n_transactions // (end - start).days)
+    day = start
+    month = None
+    n_written = 0
+    while n_written < n_transactions:
+        if day.month != month:
+            month = day.month
+            lines.append(
+                f'{day} * "Employer" "Salary"\n'
+                f"    {incomes[0]} -{rng.randint(2500, 4000)}.00 EUR\n"
+                f"    {accounts[0]}\n"
+            )
+            for expense in expenses:
+                lines.append(
+                    f'{day} * "Budget" "{expense}" #budget\n'
+                    f"    {expense} {rng.randint(10, 300)}.00 BGT_EUR\n"
+                    f"    Income:Available\n"
+                )
+            lines.append(
+                f'{day} * "" "Transfer"\n'
+                f"    {rng.choice(accounts)} {rng.randint(1, 500)}.00 EUR\n"
+                f"    {accounts[0]}\n"
+            )
+            n_written += 2 + len(expenses)
+
+        for _ in range(rng.randint(1, max_per_day)):
+            lines.append(
+                f'{day} * "PAYEE {rng.randint(1, 200)}" "Narration {n_written}"\n'
+                f"    {rng.choice(expenses)} {rng.randint(1, 20000) / 100:.2f} EUR\n"
+                f"    {rng.choice(accounts)}\n"
+            )
+            n_written += 1
+        day += datetime.timedelta(days=1)
+
+    lines.append(";;; FUTURE ;;;")
+    lines.append("")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    n_transactions = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    sys.stdout.write(generate_ledger(n_transactions))
@@ -0,0 +1,96 @@
+import datetime
+
+from beancount.core.data import Close, Open, Transaction
+
+# Posted to by the budget_eur plugin, never picked by hand
+BUDGET_ACCOUNTS = ("Income:Available", "Expenses:Spent")
+
+TRANSFER_TYPE = "Transfer"
+
+
+def split_account(account):
+    """
+    Returns the /add type and counterparty of an account, like
+    ("Expenses:Variable", "Groceries") or ("Income", "NL:Fung:Salary"), or None
+    for accounts that are not a counterparty.
+    """
+    components = account.split(":")
+    if components[0] == "Expenses" and len(components) > 2:
+        return ":".join(components[:2]), ":".join(components[2:])
+    if components[0] == "Income" and len(components) > 1:
+        return "Income", ":".join(components[1:])
+    return None
+
+
+class AccountIndex:
+    """
+    The open accounts of the ledger, by their Open and Close directives, most
+    used first. Entries appended to the ledger are added in place.
+    """
+
+    def __init__(self, entries):
+        # Account -> date it is opened on
+        self.opened = {}
+        # Account -> date it is closed on, None while it is open
+        self.open = {}
+        # Account -> number of transactions posting to it
+        self.usage = {}
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry):
+        entry_type = type(entry)
+        if entry_type is Transaction:
+            for account in {posting.account for posting in entry.postings}:
+                self.usage[account] = self.usage.get(account, 0) + 1
+        elif entry_type is Open:
+            self.opened[entry.account] = entry.date
+            self.open[entry.account] = None
+        elif entry_type is Close:
+            self.open[entry.account] = entry.date
+
+    def _by_usage(self, accounts):
+        return sorted(
+            accounts, key=lambda account: (-self.usage.get(account, 0), account)
+        )
+
+    def open_accounts(self, today=None):
+        """Returns the accounts that entries of today can post to, most used first."""
+        today = today or datetime.date.today()
+        return self._by_usage(
+            account
+            for account, close_date in self.open.items()
+            if self.opened.get(account, datetime.date.max) <= today
+            and (close_date is None or close_date >= today)
+            and account not in BUDGET_ACCOUNTS
+        )
+
+    def accounts(self, today=None):
+        """Returns the Assets and Liabilities accounts that an entry is paid from."""
+        return tuple(
+            account
+            for account in self.open_accounts(today)
+            if account.startswith(("Assets:", "Liabilities:"))
+        )
+
+    def counterparties(self, today=None):
+        """
+        Returns the counterparties of each type, like constants.get_counterparties(),
+        the most used types and counterparties first.
+        """
+        counterparties = {}
+        type_usage = {}
+        for account in self.open_accounts(today):
+            split = split_account(account)
+            if split is None:
+                continue
+            account_type, counterparty = split
+            counterparties.setdefault(account_type, []).append(counterparty)
+            type_usage[account_type] = type_usage.get(account_type, 0) + self.usage.get(
+                account, 0
+            )
+
+        types = sorted(counterparties, key=lambda type: (-type_usage[type], type))
+        counterparties = {type: tuple(counterparties[type]) for type in types}
+        counterparties[TRANSFER_TYPE] = self.accounts(today)
+        return counterparties
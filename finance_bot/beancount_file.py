@@ -1,84 +1,558 @@
-import base64
-import json
+import asyncio
+import bisect
+import gc
+import glob
 import os
-import requests
+import pickle
+import random
+import threading
+from dataclasses import dataclass, field
+from beancount import __version__ as beancount_version
 from beancount import loader
+from beancount.core import getters
+from beancount.core.data import Balance, Close, Open, Transaction, entry_sortkey
+from beancount.ops import validation
+from beancount.parser import booking, parser
 from asyncio.log import logger
 
+import budget_eur
+import ledger_files
+import metrics
+from storage import GitStorage, RestStorage
+
 REPO_OWNER = "sashalikesplanes"
 REPO_NAME = "beancount-file"
+BRANCH = os.environ.get("LEDGER_BRANCH", "main")
+# The top file of the ledger, new entries are always written to it. Past years
+# can be split out into files that it includes, which are then only parsed again
+# when they change.
 FILE_PATH = "main.beancount"
-secrets = json.loads(os.environ["SECRETS"])
-GITHUB_TOKEN = secrets["github_token"]
+REPOSITORY_URL = f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}"
+# "rest" for the GitHub API, "git" for a clone of the repository in /tmp
+STORAGE_BACKEND = os.environ.get("LEDGER_STORAGE", "rest")
+GIT_MIRROR_DIR = os.environ.get("LEDGER_GIT_MIRROR_DIR", "/tmp/beancount-file")
+
+SNAPSHOT_DIR = os.environ.get("LEDGER_SNAPSHOT_DIR", "/tmp")
+# Bump whenever the pickled layout below changes
+SNAPSHOT_FORMAT = 3
+# Re-load the whole updated ledger on every write instead of only checking the new entries
+STRICT_VALIDATION = os.environ.get("LEDGER_STRICT_VALIDATION") == "1"
+# Attempts at committing an entry when the file keeps changing under it
+MAX_WRITE_ATTEMPTS = 4
+CONFLICT_BACKOFF_SECONDS = 0.5
+
+
+@dataclass
+class Ledger:
+    sha: str
+    etag: str | None
+    content: str
+    entries: list
+    options: dict
+    # Path -> blob SHA of every file the ledger was loaded from, the top one included
+    files: dict = field(default_factory=dict)
+    # Path -> the include patterns of that file, to resolve them in a newer tree
+    includes: dict = field(default_factory=dict)
+    # Structures derived from the entries, keyed by the callable that built them
+    indexes: dict = field(default_factory=dict)
+
+    @property
+    def version(self):
+        """Identifies the content of the ledger, the same in every container."""
+        return tuple(sorted(self.files.items()))
+
+    def index(self, build):
+        """Returns build(entries), computed once per version of the ledger."""
+        if build not in self.indexes:
+            self.indexes[build] = build(self.entries)
+        return self.indexes[build]
+
+    def appended(self, sha, content, new_entries):
+        """Returns the next version of the ledger, without parsing it again.
+
+        Indexes that implement append(entry) are updated and carried over,
+        the others are rebuilt on demand.
+        """
+        if len(new_entries) == 1:
+            entries = list(self.entries)
+            bisect.insort(entries, new_entries[0], key=entry_sortkey)
+        else:
+            # Imports append thousands of entries, one merge beats as many inserts
+            entries = sorted([*self.entries, *new_entries], key=entry_sortkey)
+
+        ledger = Ledger(
+            sha=sha,
+            etag=None,
+            content=content,
+            entries=entries,
+            options=self.options,
+            files={**self.files, FILE_PATH: sha},
+            includes=self.includes,
+        )
+        for build, index in self.indexes.items():
+            if hasattr(index, "append"):
+                for entry in new_entries:
+                    index.append(entry)
+                ledger.indexes[build] = index
+        return ledger
+
+
+class _ValidationState:
+    """The parts of a ledger that new entries are validated against."""
+
+    def __init__(self, entries):
+        self.open_close = getters.get_account_open_close(entries)
+        self.balances = [entry for entry in entries if isinstance(entry, Balance)]
+
+    def append(self, entry):
+        if isinstance(entry, Open):
+            self.open_close[entry.account] = (entry, None)
+        elif isinstance(entry, Close) and entry.account in self.open_close:
+            self.open_close[entry.account] = (self.open_close[entry.account][0], entry)
+        elif isinstance(entry, Balance):
+            self.balances.append(entry)
+
+    def check(self, entry):
+        """Returns the errors of a booked transaction, and whether a full load must decide."""
+        errors = []
+        for posting in entry.postings:
+            open, close = self.open_close.get(posting.account, (None, None))
+            if open is None or open.date > entry.date:
+                errors.append(
+                    f"Invalid reference to unknown account '{posting.account}'"
+                )
+                continue
+            if close is not None and close.date < entry.date:
+                errors.append(
+                    f"Invalid reference to inactive account '{posting.account}'"
+                )
+                continue
+            if open.currencies and posting.units.currency not in open.currencies:
+                errors.append(
+                    f"Invalid currency {posting.units.currency} for account '{posting.account}'"
+                )
+
+        # A later balance assertion on one of the posted accounts (or a parent) now
+        # sees a different amount; only the running balances can tell if it still holds.
+        affects_balance = any(
+            balance.date > entry.date
+            and balance.amount.currency == posting.units.currency
+            and (
+                posting.account == balance.account
+                or posting.account.startswith(f"{balance.account}:")
+            )
+            for balance in self.balances
+            for posting in entry.postings
+        )
+        return errors, affects_balance
+
+
+def make_storage():
+    if STORAGE_BACKEND == "git":
+        logger.info(f"Reading the ledger from a clone in {GIT_MIRROR_DIR}")
+        return GitStorage(
+            f"https://github.com/{REPO_OWNER}/{REPO_NAME}.git", BRANCH, GIT_MIRROR_DIR
+        )
+
+    return RestStorage(REPOSITORY_URL, BRANCH)
+
+
+_storage = make_storage()
+
+# The last ledger seen by this container, reused for as long as GitHub reports
+# its files unchanged (304 on the ETag, or the same blob SHAs).
+_ledger: Ledger | None = None
+
+# Blob SHA -> the entries, errors and options parsed from that file, for the
+# files of the last ledger. Unchanged files are not parsed again.
+_parsed_files = {}
 
 
-def _get_file_content():
-    url = f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents/{FILE_PATH}"
-    headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json",
+async def _parse_ledger(sha, content, repository_files):
+    """Parses the top file and the files it includes, reusing the unchanged ones.
+
+    Args:
+        sha (str): The blob SHA of the top file, None if it is not committed yet.
+        content (str): The content of the top file.
+        repository_files (dict): Path -> blob SHA of the files it can include.
+
+    Returns:
+        list: The entries of the ledger.
+        dict: Its options.
+        dict: Path -> blob SHA of the files it was loaded from.
+        dict: Path -> the include patterns of each of those files.
+    """
+    global _parsed_files
+
+    parsed_files = {}
+    files = {FILE_PATH: sha}
+    includes = {}
+    parsed = []
+    n_parsed = 0
+    # One level of includes at a time, the changed files of a level are parsed together
+    level = [FILE_PATH]
+    while level:
+        to_parse = [path for path in level if files[path] not in _parsed_files]
+        to_fetch = [path for path in to_parse if path != FILE_PATH]
+        with metrics.stage("github_blob"):
+            fetched = await asyncio.gather(
+                *(_storage.get_blob(path, files[path]) for path in to_fetch)
+            )
+        contents = {FILE_PATH: content, **dict(zip(to_fetch, fetched))}
+        # Parse in a thread so that Telegram calls already in flight keep going
+        with metrics.stage("parse"):
+            results = await asyncio.to_thread(
+                ledger_files.parse_files, [(path, contents[path]) for path in to_parse]
+            )
+        results = dict(zip(to_parse, results))
+        n_parsed += len(to_parse)
+
+        next_level = []
+        for path in level:
+            result = results[path] if path in results else _parsed_files[files[path]]
+            parsed.append((path, result))
+            if files[path] is not None:
+                parsed_files[files[path]] = result
+
+            includes[path] = list(result[2]["include"])
+            for include_path in ledger_files.included_paths(
+                path, result[2], repository_files
+            ):
+                if include_path in files:
+                    raise Exception(f'File "{include_path}" is included twice')
+                files[include_path] = repository_files[include_path]
+                next_level.append(include_path)
+        level = next_level
+
+    logger.info(f"Parsed {n_parsed} of {len(parsed)} ledger files")
+    metrics.count("parsed_files", n_parsed)
+    metrics.count("parse_cache_hits", len(parsed) - n_parsed)
+    # Only keep what the current ledger still uses
+    _parsed_files = parsed_files
+
+    entries, options = await asyncio.to_thread(ledger_files.load_parsed, parsed)
+    return entries, options, files, includes
+
+
+def _snapshot_path(sha):
+    return os.path.join(SNAPSHOT_DIR, f"ledger-{sha}-{budget_eur.__version__}.pickle")
+
+
+def _etag_path(snapshot_path):
+    # The ETag changes with unrelated commits, it is kept next to the snapshot
+    # so that those don't pickle the whole ledger again
+    return f"{snapshot_path[: -len('.pickle')]}.etag"
+
+
+def _load_snapshot():
+    """Returns the ledger pickled by a previous container, if there is a usable one."""
+    paths = glob.glob(_snapshot_path("*"))
+    if not paths:
+        return None
+
+    path = max(paths, key=os.path.getmtime)
+    gc.disable()
+    try:
+        with metrics.stage("snapshot_load"), open(path, "rb") as f:
+            snapshot_format, snapshot_beancount_version, fields = pickle.load(f)
+        if (
+            snapshot_format != SNAPSHOT_FORMAT
+            or snapshot_beancount_version != beancount_version
+        ):
+            raise ValueError(f"Incompatible snapshot format {snapshot_format}")
+        ledger = Ledger(**fields)
+    except Exception as e:
+        logger.warning(f"Dropping ledger snapshot {path}: {e}")
+        os.remove(path)
+        return None
+    finally:
+        gc.enable()
+
+    try:
+        with open(_etag_path(path)) as f:
+            ledger.etag = f.read() or None
+    except OSError:
+        pass
+    return ledger
+
+
+def _save_etag(ledger):
+    """Updates the ETag of the snapshot of the ledger, returns False if it has none."""
+    path = _snapshot_path(ledger.sha)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(f"{path}.etag.tmp", "w") as f:
+            f.write(ledger.etag or "")
+        os.replace(f"{path}.etag.tmp", _etag_path(path))
+    except OSError as e:
+        logger.warning(f"Could not write ledger snapshot ETag {path}: {e}")
+    return True
+
+
+async def _save_snapshot(ledger):
+    """Pickles the ledger for the next container, in a worker thread."""
+    path = _snapshot_path(ledger.sha)
+    fields = {
+        "sha": ledger.sha,
+        "etag": ledger.etag,
+        "content": ledger.content,
+        "entries": ledger.entries,
+        "options": ledger.options,
+        "files": ledger.files,
+        "includes": ledger.includes,
     }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    await asyncio.to_thread(_write_snapshot, path, fields)
+
+
+def _write_snapshot(path, fields):
+    # Concurrent updates can save the same version, each in its own temporary file
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with metrics.stage("snapshot_save"), open(tmp_path, "wb") as f:
+            pickle.dump(
+                (SNAPSHOT_FORMAT, beancount_version, fields),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError) as e:
+        logger.warning(f"Could not write ledger snapshot {path}: {e}")
+        return
 
+    # Snapshots of older versions of the file, or of other plugin versions
+    for stale_path in glob.glob(os.path.join(SNAPSHOT_DIR, "ledger-*.pickle")):
+        if stale_path != path:
+            os.remove(stale_path)
+    # The ETag in the new snapshot is the latest one
+    for stale_path in glob.glob(os.path.join(SNAPSHOT_DIR, "ledger-*.etag")):
+        os.remove(stale_path)
 
-def write_to_file(str):
-    file_data = _get_file_content()
-    content = file_data["content"]
-    decoded_content = base64.b64decode(content).decode("utf-8")
 
+def _measured(ledger, cache):
+    """Records the size of the loaded ledger and how it was loaded, and returns it."""
+    metrics.set_property("ledger_cache", cache)
+    metrics.put_metric("ledger_bytes", len(ledger.content), "Bytes")
+    metrics.put_metric("ledger_entries", len(ledger.entries))
+    metrics.put_metric("ledger_files", len(ledger.files))
+    return ledger
+
+
+def _included_files(includes, repository_files):
+    """Returns the paths of the top file and of every file it includes in the repository."""
+    paths = {FILE_PATH}
+    for path, patterns in includes.items():
+        paths.update(
+            ledger_files.included_paths(path, {"include": patterns}, repository_files)
+        )
+    return paths
+
+
+async def _load_ledger():
+    global _ledger
+
+    if _ledger is None:
+        _ledger = _load_snapshot()
+        metrics.set_property("ledger_snapshot", _ledger is not None)
+
+    with metrics.stage("github_tree"):
+        tree = await _storage.get_tree(None if _ledger is None else _ledger.etag)
+    if tree is None:
+        logger.info(f"Ledger {_ledger.sha} not modified")
+        return _measured(_ledger, "not_modified")
+
+    # Other files of the repository may have changed, or a file may have been
+    # added that an include glob matches
+    if (
+        _ledger is not None
+        and all(tree["files"].get(path) == sha for path, sha in _ledger.files.items())
+        and _included_files(_ledger.includes, tree["files"]) == set(_ledger.files)
+    ):
+        if _ledger.etag != tree["etag"]:
+            _ledger.etag = tree["etag"]
+            # After a write of this container, there is no snapshot of it yet
+            if not _save_etag(_ledger):
+                await _save_snapshot(_ledger)
+        return _measured(_ledger, "unchanged")
+
+    sha = tree["files"][FILE_PATH]
+    if _ledger is not None and _ledger.sha == sha:
+        content = _ledger.content
+    else:
+        with metrics.stage("github_blob"):
+            content = await _storage.get_blob(FILE_PATH, sha)
+
+    entries, options, files, includes = await _parse_ledger(sha, content, tree["files"])
+    _ledger = Ledger(
+        sha=sha,
+        etag=tree["etag"],
+        content=content,
+        entries=entries,
+        options=options,
+        files=files,
+        includes=includes,
+    )
+    await _save_snapshot(_ledger)
+    return _measured(_ledger, "parsed")
+
+
+def _validate_new_entries(ledger, str):
+    """Parses only the new entries and checks them against the cached ledger.
+
+    Returns the entries as the loader would have produced them, or None if a
+    balance assertion is affected and the whole ledger has to be loaded.
+    """
+    new_entries, errors, _ = parser.parse_string(str)
+    if not errors:
+        new_entries, errors = booking.book(new_entries, ledger.options)
+    if not errors:
+        # Keeps the budget_eur memo of the whole ledger for its next full load
+        with budget_eur.appending():
+            new_entries, errors = loader.run_transformations(
+                new_entries, errors, ledger.options, None
+            )
+    if not errors:
+        errors = validation.validate_check_transaction_balances(
+            new_entries, ledger.options
+        )
+
+    if errors:
+        for error in errors:
+            logger.error(error)
+        raise Exception(f"Error loading Beancount file: {errors}")
+
+    state = ledger.index(_ValidationState)
+    needs_full_load = False
+    for entry in new_entries:
+        if not isinstance(entry, Transaction):
+            # Directives other than transactions can affect any earlier entry
+            return None
+
+        entry_errors, affects_balance = state.check(entry)
+        errors.extend(entry_errors)
+        needs_full_load = needs_full_load or affects_balance
+
+    if errors:
+        raise Exception(f"Error loading Beancount file: {errors}")
+
+    return None if needs_full_load else new_entries
+
+
+def _insert_entries(decoded_content, str):
     future_marker = ";;; FUTURE ;;;"
-    if future_marker in decoded_content:
-        # Find the position of the future marker
-        insert_position = decoded_content.index(future_marker)
+    # Find the position of the future marker
+    insert_position = decoded_content.find(future_marker)
+    if insert_position == -1:
+        # If the future marker is not found, append to the end
+        insert_position = len(decoded_content)
+    else:
         # Check if the character before the marker is a newline
         if insert_position > 0 and decoded_content[insert_position - 1] == "\n":
             insert_position -= 1
         if insert_position > 0 and decoded_content[insert_position - 1] == "\n":
             insert_position -= 1
-        # Insert the new content
-        updated_content = (
-            decoded_content[:insert_position]
-            + f"\n{str}\n"
-            + decoded_content[insert_position:]
+
+    # Insert the new content. A single join copies the ledger once, where
+    # concatenating the parts builds a full-size intermediate string
+    return "".join(
+        (
+            decoded_content[:insert_position],
+            f"\n{str}\n",
+            decoded_content[insert_position:],
+        )
+    )
+
+
+async def write_to_file(
+    str, strict=STRICT_VALIDATION, message="Telegram bot update", check=None
+):
+    """Inserts one or more entries before the future marker and commits them in one PUT.
+
+    The commit only succeeds on the version of the file the entries were validated
+    against. If something else committed in the meantime (a 409 from the contents
+    API, a rejected push), the entries are inserted into the new version,
+    validated and committed again.
+
+    check(ledger), if given, is called with every version the entries are about
+    to be inserted into, and raises to give up the write, such as when what was
+    committed in the meantime makes the entries duplicates.
+    """
+    global _ledger
+
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        ledger = await _load_ledger()
+        if check is not None:
+            check(ledger)
+        updated_content = _insert_entries(ledger.content, str)
+
+        # Validate the updated content
+        with metrics.stage("validate_new_entries"):
+            new_entries = None if strict else _validate_new_entries(ledger, str)
+        if new_entries is None:
+            # Only the top file changed, the files it includes are not parsed again
+            entries, options, files, includes = await _parse_ledger(
+                None, updated_content, ledger.files
+            )
+
+        # Update the file on GitHub
+        with metrics.stage("github_put"):
+            new_sha = await _storage.put_file(
+                FILE_PATH, updated_content, ledger.sha, message
+            )
+        metrics.count("write_attempts")
+        if new_sha is not None:
+            break
+        if attempt == MAX_WRITE_ATTEMPTS - 1:
+            raise Exception(
+                f"Ledger changed {MAX_WRITE_ATTEMPTS} times while writing, try again"
+            )
+
+        logger.warning(
+            f"Ledger {ledger.sha} changed while writing, retrying ({attempt + 1})"
+        )
+        # Jitter keeps two containers that conflicted from retrying in lockstep
+        await asyncio.sleep(CONFLICT_BACKOFF_SECONDS * 2**attempt * random.random())
+
+    # The ETag of the new version is unknown until the next GET, but the blob
+    # SHA lets that GET skip the parse. The snapshot is written once it is known.
+    if new_entries is None:
+        _ledger = Ledger(
+            sha=new_sha,
+            etag=None,
+            content=updated_content,
+            entries=entries,
+            options=options,
+            files={**files, FILE_PATH: new_sha},
+            includes=includes,
         )
     else:
-        # If the future marker is not found, append to the end
-        updated_content = decoded_content + f"\n{str}\n"
+        _ledger = ledger.appended(new_sha, updated_content, new_entries)
 
-    # Validate the updated content
-    _, errors, _ = loader.load_string(updated_content, log_errors=logger.error)
+    # Handed to the follow-up reports so that they don't fetch the file again
+    return _ledger
 
-    if errors:
-        raise Exception(f"Error loading Beancount file: {errors}")
 
-    # Update the file on GitHub
-    url = f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents/{FILE_PATH}"
-    headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json",
-    }
-    data = {
-        "message": "Telegram bot update",
-        "content": base64.b64encode(updated_content.encode()).decode(),
-        "sha": file_data["sha"],
-    }
-    response = requests.put(url, headers=headers, json=data)
-    response.raise_for_status()
+async def get_ledger():
+    return await _load_ledger()
 
 
-def get_entries():
-    file_data = _get_file_content()
-    content = file_data["content"]
-    decoded_content = base64.b64decode(content).decode("utf-8")
+async def get_cached_ledger():
+    """
+    Returns the ledger last seen by this container without asking GitHub whether
+    it changed, only loading it if there is none. For what a slightly outdated
+    ledger is good enough for, like the choices offered by /add.
+    """
+    global _ledger
 
-    # Load the Beancount file
-    entries, errors, options = loader.load_string(
-        decoded_content, log_errors=logger.error
-    )
+    if _ledger is None:
+        _ledger = _load_snapshot()
+    if _ledger is None:
+        return await _load_ledger()
+    return _ledger
 
-    if errors:
-        raise Exception(f"Error loading Beancount file: {errors}")
 
-    return entries, options
+async def get_entries():
+    ledger = await _load_ledger()
+
+    # Callers add report parameters to the options, keep the cached ones clean
+    return ledger.entries, dict(ledger.options)
@@ -1,11 +1,29 @@
+import time
+
+# Cold start breakdown, logged once the app is ready
+init_timings = {}
+_init_start = time.perf_counter()
+
 import json
 import asyncio
 import os
 import logging
 from telegram._update import Update
 from telegram.ext import ApplicationBuilder
+from telegram.request import HTTPXRequest
+
+init_timings["import_telegram"] = time.perf_counter() - _init_start
+
+# Only imports what every update needs, beancount is loaded by the handlers
+# that read or write the ledger
+import metrics
 from handlers import add_handlers
+from persistence import make_persistence, refresh_conversations
+from webhook_reply import start_reply
 
+init_timings["import_handlers"] = (
+    time.perf_counter() - _init_start - init_timings["import_telegram"]
+)
 
 # Enable logging
 logging.basicConfig(
@@ -18,30 +36,112 @@ secrets = json.loads(os.environ["SECRETS"])
 logger = logging.getLogger(__name__)
 
 
-# Global variable to store the initialized application
+class TimedRequest(HTTPXRequest):
+    """Bot API requests, timed as the "telegram" stage of the update."""
+
+    async def do_request(self, *args, **kwargs):
+        with metrics.stage("telegram"):
+            return await super().do_request(*args, **kwargs)
+
+
+async def build_app():
+    start = time.perf_counter()
+    app = (
+        ApplicationBuilder()
+        .token(secrets["telegram_token"])
+        .request(TimedRequest(connection_pool_size=256))
+        .persistence(make_persistence())
+        .build()
+    )
+    app = add_handlers(app)
+    init_timings["build_app"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await app.initialize()
+    init_timings["initialize_app"] = time.perf_counter() - start
+    return app
+
+
+# One loop for the life of the container, the GitHub and Telegram connection
+# pools are bound to it
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+# Build the application during the Lambda init phase, if that fails it is built
+# again by the first update
 initialized_app = None
+try:
+    initialized_app = loop.run_until_complete(build_app())
+except Exception as exc:
+    logger.error(f"Could not initialize the application: {exc}")
+# The first update of the container reports the init timings
+cold_start = True
+
+init_timings["total"] = time.perf_counter() - _init_start
+logger.info(
+    "Cold start: "
+    + ", ".join(
+        f"{name}={seconds * 1000:.0f}ms" for name, seconds in init_timings.items()
+    )
+)
+
+
+def update_kind(update):
+    """Returns the command of an update, or what kind of update it is."""
+    if update.callback_query is not None:
+        return "callback_query"
+    message = update.effective_message
+    if message is None:
+        return "other"
+    if message.text and message.text.startswith("/"):
+        return message.text.split()[0].split("@")[0]
+    if message.document is not None:
+        return "document"
+    return "message"
 
 
 async def process_update_in_lambda(event, context):
-    global initialized_app
+    global initialized_app, cold_start
+
+    metrics.start_record(cold_start=cold_start)
+    if cold_start:
+        for name, seconds in init_timings.items():
+            metrics.put_metric(f"init_{name}", seconds * 1000, "Milliseconds")
+        cold_start = False
 
     if initialized_app is None:
-        app = ApplicationBuilder().token(secrets["telegram_token"]).build()
-        app = add_handlers(app)
-        await app.initialize()
-        initialized_app = app
+        initialized_app = await build_app()
 
     try:
+        # Another container may have moved the conversation on
+        with metrics.stage("refresh_conversations"):
+            await refresh_conversations(initialized_app)
+        # Handlers can leave one Bot API call for Telegram to make from the response
+        reply = start_reply()
+        update = Update.de_json(json.loads(event["body"]), initialized_app.bot)
+        metrics.set_property("Update", update_kind(update))
         # Process the update using the initialized application
-        await initialized_app.process_update(
-            Update.de_json(json.loads(event["body"]), initialized_app.bot)
-        )
+        with metrics.stage("process_update"):
+            await initialized_app.process_update(update)
+        # There is no background job writing the persistence in a Lambda
+        with metrics.stage("update_persistence"):
+            await initialized_app.update_persistence()
+
+        if reply:
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(reply),
+            }
         return {"statusCode": 200, "body": "Success"}
 
     except Exception as exc:
         logger.error(exc)
         return {"statusCode": 500, "body": "Failure"}
 
+    finally:
+        metrics.emit()
+
 
 def lambda_handler(event, context):
     headers = event.get("headers")
@@ -52,6 +152,4 @@ def lambda_handler(event, context):
     if secret_token != secrets["telegram_secret_token"]:
         return {"statusCode": 401, "body": "Unauthorized"}
 
-    return asyncio.get_event_loop().run_until_complete(
-        process_update_in_lambda(event, context)
-    )
+    return loop.run_until_complete(process_update_in_lambda(event, context))
@@ -1,49 +1,89 @@
+from contextlib import contextmanager
+
+from beancount.core.amount import Amount
 from beancount.core.data import (
     Entries,
+    Posting,
     Transaction,
-    create_simple_posting,
 )
 
 __plugins__ = ["budget_eur"]
+# Part of the ledger snapshot key, bump whenever the generated postings change
+__version__ = "2"
+
+# The postings generated for each transaction of the last load, keyed by the
+# accounts and units of its postings. Unchanged history is reused on the next
+# load instead of being generated again.
+_memo = {}
+# Set while the plugin runs on entries appended to the last load, not a whole ledger
+_appending = False
+
+
+@contextmanager
+def appending():
+    """Adds what the plugin generates in the block to the memo instead of replacing it."""
+    global _appending
+
+    _appending = True
+    try:
+        yield
+    finally:
+        _appending = False
 
 
 def budget_eur(entries: Entries, options_map):
-    return [budget_eur_entry(e) for e in entries], []
+    global _memo
 
+    memo = {}
+    entries = [budget_eur_entry(e, memo) for e in entries]
+    if _appending:
+        _memo.update(memo)
+    else:
+        # Only keep what the current ledger still uses
+        _memo = memo
+    return entries, []
 
-def budget_eur_entry(entry):
-    if not isinstance(entry, Transaction):  # type: ignore
+
+def _posting_key(posting):
+    units = posting.units
+    # Equal numbers like 1.0 and 1.00 generate postings that print differently
+    return posting.account, units, units and str(units.number)
+
+
+def budget_eur_entry(entry, memo=None):
+    if type(entry) is not Transaction:
         return entry
 
-    for posting in entry.postings:
-        if posting.account.startswith("Income:") and posting.units.currency == "EUR":
-            create_simple_posting(
-                entry,
-                "Income:Available",
-                posting.units.number * -1,
-                "BGT_EUR",
-            )
-
-            create_simple_posting(
-                entry,
-                posting.account,
-                posting.units.number,
-                "BGT_EUR",
-            )
-
-        if posting.account.startswith("Expenses:") and posting.units.currency == "EUR":
-            create_simple_posting(
-                entry,
-                "Expenses:Spent",
-                posting.units.number,
-                "BGT_EUR",
-            )
-
-            create_simple_posting(
-                entry,
-                posting.account,
-                posting.units.number * -1,
-                "BGT_EUR",
-            )
+    key = tuple([_posting_key(posting) for posting in entry.postings])
+    generated = _memo.get(key)
+    if generated is None:
+        generated = _budget_postings(entry)
+    if memo is not None:
+        memo[key] = generated
 
+    entry.postings.extend(generated)
     return entry
+
+
+def _budget_postings(entry):
+    generated = []
+    for posting in entry.postings:
+        units = posting.units
+        if units is None or units.currency != "EUR":
+            continue
+
+        account = posting.account
+        if account.startswith("Income:"):
+            generated.append(_simple_posting("Income:Available", units.number * -1))
+            generated.append(_simple_posting(account, units.number))
+
+        elif account.startswith("Expenses:"):
+            generated.append(_simple_posting("Expenses:Spent", units.number))
+            generated.append(_simple_posting(account, units.number * -1))
+
+    return generated
+
+
+def _simple_posting(account, number):
+    # Same posting as create_simple_posting, shared between identical transactions
+    return Posting(account, Amount(number, "BGT_EUR"), None, None, None, None)
@@ -0,0 +1,161 @@
+import datetime
+from decimal import Decimal
+
+import numpy as np
+from beancount.core.data import Transaction
+
+# Amounts are stored as integers of this many decimal places
+AMOUNT_DIGITS = 6
+# Days are counted from the epoch of NumPy's datetime64
+_EPOCH = datetime.date(1970, 1, 1)
+# No currency, for postings without units
+NO_CURRENCY = -1
+
+
+class PostingColumns:
+    """
+    The postings of the ledger's transactions as NumPy columns, one row per
+    posting, for vectorized group-bys over the whole history:
+
+    - day: int32 days since 1970-01-01 of the transaction
+    - account, currency: int32 ids into `accounts` and `currencies`
+    - number: int64 units, fixed point with AMOUNT_DIGITS decimal places
+    - tags: uint64 bitmask of the transaction tags, bits of `tags`
+    - at_cost: whether the posting is held at cost, which the columns don't keep
+
+    Built once per version of the ledger. Entries appended to it are collected
+    and added to the columns on the next read. `exact` is False if an amount
+    has more decimal places or digits than the columns hold, or the ledger has
+    more than 64 tags, in which case the Decimal path has to be used.
+    """
+
+    def __init__(self, entries):
+        self.accounts = []
+        self.currencies = []
+        self.tags = []
+        self._ids = ({}, {}, {})
+        self.exact = True
+        # Rows not in the arrays yet, one list per column
+        self._pending = ([], [], [], [], [], [])
+        self._arrays = tuple(
+            np.zeros(0, dtype)
+            for dtype in (np.int32, np.int32, np.int32, np.int64, np.uint64, np.bool_)
+        )
+        for entry in entries:
+            self.append(entry)
+
+    def _id(self, kind, names, name):
+        ids = self._ids[kind]
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def append(self, entry):
+        if type(entry) is not Transaction:
+            return
+
+        days, accounts, currencies, numbers, tags, at_cost = self._pending
+        day = (entry.date - _EPOCH).days
+        tag_mask = 0
+        for tag in entry.tags or ():
+            bit = self._id(2, self.tags, tag)
+            if bit >= 64:
+                self.exact = False
+            else:
+                tag_mask |= 1 << bit
+
+        for posting in entry.postings:
+            days.append(day)
+            accounts.append(self._id(0, self.accounts, posting.account))
+            tags.append(tag_mask)
+            at_cost.append(posting.cost is not None)
+
+            units = posting.units
+            if units is None or units.currency is None:
+                currencies.append(NO_CURRENCY)
+                numbers.append(0)
+                continue
+            currencies.append(self._id(1, self.currencies, units.currency))
+            scaled = units.number.scaleb(AMOUNT_DIGITS)
+            number = int(scaled)
+            if number != scaled or not -(2**63) <= number < 2**63:
+                self.exact = False
+                number = 0
+            numbers.append(number)
+
+    def _columns(self):
+        if self._pending[0]:
+            self._arrays = tuple(
+                np.concatenate([array, np.array(values, dtype=array.dtype)])
+                for array, values in zip(self._arrays, self._pending)
+            )
+            for values in self._pending:
+                values.clear()
+        return self._arrays
+
+    @property
+    def day(self):
+        return self._columns()[0]
+
+    @property
+    def account(self):
+        return self._columns()[1]
+
+    @property
+    def currency(self):
+        return self._columns()[2]
+
+    @property
+    def number(self):
+        return self._columns()[3]
+
+    @property
+    def at_cost(self):
+        return self._columns()[5]
+
+    def day_number(self, date):
+        """Returns the number of a date in the day column."""
+        return (date - _EPOCH).days
+
+    def month_numbers(self):
+        """Returns the number of months since 1970-01 of each posting."""
+        months = self.day.astype("datetime64[D]").astype("datetime64[M]")
+        return months.astype(np.int64)
+
+    def month_of_year(self):
+        """Returns the month, 1 to 12, of each posting."""
+        return self.month_numbers() % 12 + 1
+
+    def currency_id(self, currency):
+        """Returns the id of a currency, one no posting has if the ledger has none."""
+        return self._ids[1].get(currency, -2)
+
+    def account_mask(self, predicate):
+        """Returns which postings are to an account that predicate(account) holds for."""
+        matches = np.array(
+            [bool(predicate(account)) for account in self.accounts], dtype=np.bool_
+        )
+        return matches[self.account]
+
+    def tag_mask(self, tag):
+        """Returns which postings are of a transaction with the tag."""
+        bit = self._ids[2].get(tag)
+        if bit is None or bit >= 64:
+            return np.zeros(len(self.day), np.bool_)
+        return (self._columns()[4] & np.uint64(1 << bit)) != 0
+
+    def sum_by_account(self, mask):
+        """
+        Returns the sum of the numbers of the masked postings per account, and
+        which accounts have any of them, as arrays indexed by account id.
+        """
+        accounts = self.account[mask]
+        totals = np.zeros(len(self.accounts), np.int64)
+        np.add.at(totals, accounts, self.number[mask])
+        present = np.bincount(accounts, minlength=len(self.accounts)) > 0
+        return totals, present
+
+    def to_decimal(self, number):
+        """Returns a fixed point number of the columns as a Decimal."""
+        return Decimal(int(number)).scaleb(-AMOUNT_DIGITS)
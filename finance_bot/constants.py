@@ -1,3 +1,4 @@
+# What /add offers when the ledger can't be loaded, otherwise its open accounts are
 ACCOUNTS = (
     "Assets:NL:ING:Checking59",
     "Assets:NL:ING:Checking34",
@@ -45,3 +46,45 @@ def get_accounts():
 
 def get_counterparties():
     return COUNTERPARTIES
+
+
+# Ledger account of each bank statement format, unless the upload says otherwise
+STATEMENT_ACCOUNTS = {
+    "ING": "Assets:NL:ING:Checking59",
+    "WISE": "Assets:BE:WISE:Checking",
+    "AMEX": "Liabilities:NL:AMEX:Green",
+}
+
+# Counterparty of imported transactions, by the first regex matching the payee
+# or description. Unmatched transactions are flagged for review. The patterns are
+# anchored on word boundaries, so that FEE doesn't match COFFEE.
+CATEGORY_RULES = (
+    (r"\b(?:ALBERT HEIJN|JUMBO|LIDL|ALDI|DIRK|PLUS)\b", "Expenses:Variable:Groceries"),
+    (
+        r"\b(?:THUISBEZORGD|DELIVEROO|UBER \*?EATS|RESTAURANT|CAFE|BAR)\b",
+        "Expenses:Variable:EatOut",
+    ),
+    (
+        r"\b(?:NS|NS GROEP|OV-?CHIPKAART|GVB|RET|UBER|BOLT)\b",
+        "Expenses:Variable:Transport",
+    ),
+    (r"\b(?:KRUIDVAT|ETOS|KAPPER|BARBER)\b", "Expenses:Variable:PersonalCare"),
+    (r"\b(?:SPOTIFY|APPLE\.COM/BILL)\b", "Expenses:Fixed:Music"),
+    (r"\b(?:KPN|VODAFONE|ODIDO|T-MOBILE|LEBARA)\b", "Expenses:Fixed:Phone"),
+    (r"\b(?:BASIC-FIT|BASIC FIT|SPORTCITY)\b", "Expenses:Fixed:Fitness"),
+    (r"\b(?:ZILVEREN KRUIS|CZ ZORG|VGZ|MENZIS|ASR)\b", "Expenses:Fixed:Insurance"),
+    (r"\b(?:BELASTINGDIENST|GEMEENTE)\b", "Expenses:Variable:HouseTax"),
+    (r"\b(?:KOSTEN|FEES?|BETAALPAKKET)\b", "Expenses:Variable:BankFees"),
+    (r"\b(?:RENTE|INTEREST)\b", "Income:Interest"),
+)
+# Unmatched debits and credits, credits are income rather than negative spending
+UNCATEGORIZED_ACCOUNT = "Expenses:Variable:Forgotten"
+UNCATEGORIZED_INCOME_ACCOUNT = "Income:Forgotten"
+
+
+def get_statement_accounts():
+    return STATEMENT_ACCOUNTS
+
+
+def get_category_rules():
+    return CATEGORY_RULES
@@ -0,0 +1,93 @@
+import datetime
+import os
+import re
+from decimal import Decimal
+
+from beancount.core.data import Transaction
+
+# Bank statements and manual entries can disagree on the date by a few days
+DUPLICATE_WINDOW_DAYS = int(os.environ.get("DUPLICATE_WINDOW_DAYS", "3"))
+
+_non_alphanumeric = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_payee(payee):
+    return _non_alphanumeric.sub(" ", (payee or "").lower()).strip()
+
+
+class DuplicateIndex:
+    """
+    Transactions by (date, account, amount, currency, normalized payee) of their
+    Assets and Liabilities postings, the side that a bank statement also shows.
+
+    A lookup probes each day of the window, so it costs the same on any size of
+    ledger, and entries appended to the ledger are added in place.
+    """
+
+    def __init__(self, entries, window_days=DUPLICATE_WINDOW_DAYS):
+        # Closest dates first
+        self.offsets = [
+            datetime.timedelta(days=days)
+            for days in sorted(range(-window_days, window_days + 1), key=abs)
+        ]
+        self.transactions = {}
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry):
+        if type(entry) is not Transaction:
+            return
+
+        payee = normalize_payee(entry.payee)
+        for posting in entry.postings:
+            if posting.units is None or not posting.account.startswith(
+                ("Assets:", "Liabilities:")
+            ):
+                continue
+            key = (
+                entry.date,
+                posting.account,
+                posting.units.number,
+                posting.units.currency,
+                payee,
+            )
+            self.transactions.setdefault(key, []).append(entry)
+
+    def find(self, date, account, amount, payee, currency="EUR", exclude=()):
+        """
+        Returns a transaction posting the same amount to the same account with the
+        same payee within the window around the date, or None.
+
+        Args:
+            exclude (set): ids of transactions already matched, so that each one
+                only stands for a single duplicate.
+        """
+        payee = normalize_payee(payee)
+        amount = Decimal(amount)
+        for offset in self.offsets:
+            key = (date + offset, account, amount, currency, payee)
+            for entry in self.transactions.get(key, ()):
+                if id(entry) not in exclude:
+                    return entry
+        return None
+
+
+def split_duplicates(drafts, index):
+    """
+    Splits statement drafts into new ones and the ones already in the ledger.
+
+    Every ledger transaction matches at most one draft, so that a statement with
+    two identical payments on the same day keeps the one that is missing.
+    """
+    new_drafts, duplicates = [], []
+    matched = set()
+    for draft in drafts:
+        existing = index.find(
+            draft.date, draft.account, draft.amount, draft.payee, exclude=matched
+        )
+        if existing is None:
+            new_drafts.append(draft)
+        else:
+            matched.add(id(existing))
+            duplicates.append(draft)
+    return new_drafts, duplicates
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import httpx
+from asyncio.log import logger
+
+secrets = json.loads(os.environ["SECRETS"])
+GITHUB_TOKEN = secrets["github_token"]
+
+TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+LIMITS = httpx.Limits(max_connections=4, keepalive_expiry=300)
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 0.25
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# One pool for the life of the Lambda container, so warm invocations reuse the
+# TLS connection to api.github.com.
+_client: httpx.AsyncClient | None = None
+
+
+def get_client():
+    global _client
+
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"token {GITHUB_TOKEN}",
+                "Accept": "application/vnd.github.v3+json",
+            },
+            timeout=TIMEOUT,
+            limits=LIMITS,
+        )
+    return _client
+
+
+async def request(method, url, idempotent=True, stream=False, **kwargs):
+    """Sends a request, retrying with exponential backoff.
+
+    Requests that are not idempotent are only retried when the connection could
+    not be made, as GitHub may have applied them even if the response was lost.
+    With stream=True the body is left unread, and the caller must close the
+    response.
+    """
+    client = get_client()
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        try:
+            response = await client.send(
+                client.build_request(method, url, **kwargs), stream=stream
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            if last_attempt:
+                raise
+            logger.warning(f"GitHub {method} {url} failed to connect: {e}")
+        except httpx.TransportError as e:
+            if last_attempt or not idempotent:
+                raise
+            logger.warning(f"GitHub {method} {url} failed: {e}")
+        else:
+            if (
+                last_attempt
+                or not idempotent
+                or response.status_code not in RETRY_STATUSES
+            ):
+                return response
+            logger.warning(f"GitHub {method} {url} returned {response.status_code}")
+            await response.aclose()
+
+        await asyncio.sleep(BACKOFF_SECONDS * 2**attempt)
@@ -1,29 +1,76 @@
+import asyncio
 import datetime
+import html
 import json
 import os
 import logging
-from telegram import ForceReply, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    ForceReply,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from telegram._update import Update
 from telegram.constants import ChatAction
-from beancount_file import write_to_file, get_entries
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
     ContextTypes,
     CommandHandler,
+    InlineQueryHandler,
     MessageHandler,
     ConversationHandler,
     filters,
 )
 
+from decimal import Decimal
+from typing import TYPE_CHECKING
+
 from constants import get_accounts, get_counterparties
-from reports import generate_account_report, generate_monthly_budget_report
+from webhook_reply import answer_callback_query
+
+# beancount_file and reports pull in beancount, they are imported by the
+# handlers that need them so that other updates don't pay for it on a cold start
+if TYPE_CHECKING:
+    from beancount_file import Ledger
+    from duplicates import DuplicateIndex
+    from suggestions import SuggestionIndex
 
 logger = logging.getLogger(__name__)
 secrets = json.loads(os.environ["SECRETS"])
 
 
-async def budget_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _fetch_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    from beancount_file import get_ledger
+
+    # Start the GitHub fetch first so the chat action goes out while it runs
+    ledger_task = asyncio.create_task(get_ledger())
+    try:
+        await context.bot.send_chat_action(
+            chat_id=update.effective_chat.id, action=ChatAction.TYPING
+        )
+    except BaseException:
+        # Nothing awaits the fetch then, cancel it and retrieve its outcome so
+        # that its exception is not logged as never retrieved
+        ledger_task.cancel()
+        await asyncio.gather(ledger_task, return_exceptions=True)
+        raise
+
+    try:
+        return await ledger_task
+    except Exception as e:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Error loading Beancount file:\n{str(e)}",
+            parse_mode="HTML",
+        )
+        return None
+
+
+async def budget_report(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, ledger: "Ledger | None" = None
+):
     logger.info(f"Got update")
     if update.effective_chat is None:
         logger.warn(f"Update has no chat")
@@ -50,24 +97,29 @@ async def budget_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         filtered = True
 
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id, action=ChatAction.TYPING
-    )
+    if ledger is None:
+        ledger = await _fetch_ledger(update, context)
+        if ledger is None:
+            return
+    entries, options = ledger.entries, dict(ledger.options)
 
-    try:
-        entries, options = get_entries()
-    except Exception as e:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"Error loading Beancount file:\n{str(e)}",
-            parse_mode="HTML",
-        )
-        return
+    from columnar import PostingColumns
+    from reports import BudgetRollup, cached_report, generate_monthly_budget_report
 
     options["filtered"] = filtered
     options["n_months_ahead"] = n_months_ahead
 
-    table = generate_monthly_budget_report(entries, options)
+    def render():
+        columns = ledger.index(PostingColumns)
+        # Only needed when the columns can't hold every amount exactly
+        rollup = None if columns.exact else ledger.index(BudgetRollup)
+        return generate_monthly_budget_report(entries, options, rollup, columns)
+
+    table = cached_report(
+        ledger.version,
+        ("budget", n_months_ahead, filtered, datetime.date.today()),
+        render,
+    )
 
     # construct a table with accounts and assigned and available
     await context.bot.send_message(
@@ -77,34 +129,100 @@ async def budget_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def account_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def account_report(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, ledger: "Ledger | None" = None
+):
     logger.info(f"Got update")
     if update.effective_chat is None:
         logger.warn(f"Update has no chat")
         return
 
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id, action=ChatAction.TYPING
+    if ledger is None:
+        ledger = await _fetch_ledger(update, context)
+        if ledger is None:
+            return
+    entries, options = ledger.entries, dict(ledger.options)
+
+    from columnar import PostingColumns
+    from reports import cached_report, generate_account_report
+
+    table = cached_report(
+        ledger.version,
+        ("accounts", datetime.date.today()),
+        lambda: generate_account_report(entries, options, ledger.index(PostingColumns)),
     )
 
+    # construct a table with accounts and assigned and available
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=table,
+        parse_mode="HTML",
+    )
+
+
+# Months /trend shows by default, "all" shows the whole history
+TREND_MONTHS = 12
+
+
+async def trend_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"Got update")
+    if update.effective_chat is None:
+        logger.warn(f"Update has no chat")
+        return
+
+    # /trend [account] [months], the account can be left out
+    args = list(context.args or [])
+    account = None
+    if args and not args[0].lstrip("-").isdigit() and args[0].lower() != "all":
+        account = args.pop(0)
     try:
-        entries, options = get_entries()
-    except Exception as e:
+        if not args:
+            n_months = TREND_MONTHS
+        elif args[0].lower() == "all":
+            n_months = None
+        else:
+            n_months = int(args[0])
+            if n_months <= 0:
+                raise ValueError("Number must be positive")
+    except ValueError:
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text=f"Error loading Beancount file:\n{str(e)}",
+            text='Error: Please provide a positive number of months, or "all".',
             parse_mode="HTML",
         )
         return
 
-    table = generate_account_report(entries, options)
+    ledger = await _fetch_ledger(update, context)
+    if ledger is None:
+        return
+    entries, options = ledger.entries, dict(ledger.options)
 
-    # construct a table with accounts and assigned and available
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=table,
-        parse_mode="HTML",
-    )
+    from columnar import PostingColumns
+    from reports import cached_report, generate_trend_report
+
+    try:
+        tables = cached_report(
+            ledger.version,
+            ("trend", account and account.lower(), n_months, datetime.date.today()),
+            lambda: generate_trend_report(
+                entries, options, account, n_months, ledger.index(PostingColumns)
+            ),
+        )
+    except ValueError as e:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Error: {html.escape(str(e))}",
+            parse_mode="HTML",
+        )
+        return
+
+    # Long histories take several messages
+    for table in tables:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=table,
+            parse_mode="HTML",
+        )
 
 
 # Stages
@@ -121,6 +239,112 @@ async def account_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ) = range(9)
 
 
+# Callback data of the suggestion buttons, followed by the kind of text and the
+# text itself, or "#" and its index in user_data if the text is too long for it
+SUGGESTION_PREFIX = "suggestion:"
+SUGGESTION_COUNT = 6
+# Telegram's limit on the size of callback data
+CALLBACK_DATA_BYTES = 64
+
+
+async def get_cached_ledger() -> "Ledger | None":
+    """Returns the ledger this container last saw, None if it can't be loaded."""
+    from beancount_file import get_cached_ledger
+
+    try:
+        return await get_cached_ledger()
+    except Exception as e:
+        logger.warning(f"No ledger: {e}")
+        return None
+
+
+async def get_index(build):
+    """
+    Returns an index of the ledger this container last saw, without asking GitHub
+    whether it changed, None if the ledger can't be loaded.
+    """
+    ledger = await get_cached_ledger()
+    if ledger is None:
+        return None
+    if build in ledger.indexes:
+        return ledger.indexes[build]
+    # Only built once per version of the ledger, but that takes a while
+    return await asyncio.to_thread(ledger.index, build)
+
+
+async def get_suggestions() -> "SuggestionIndex | None":
+    """Returns the payees and narrations of the ledger, None if it can't be loaded."""
+    from suggestions import SuggestionIndex
+
+    return await get_index(SuggestionIndex)
+
+
+async def get_choices():
+    """
+    Returns the accounts and the counterparties of each type that /add offers,
+    the open ones of the ledger, or the ones of constants.py if it can't be loaded.
+    """
+    from accounts import AccountIndex
+
+    index = await get_index(AccountIndex)
+    if index is None:
+        return get_accounts(), get_counterparties()
+    return index.accounts(), index.counterparties()
+
+
+def suggestion_pattern(kind: str) -> str:
+    """Returns the callback data pattern of the buttons of suggestion_keyboard()."""
+    return f"^{SUGGESTION_PREFIX}{kind}[:#]"
+
+
+def suggestion_keyboard(user_data: dict, kind: str, texts: list):
+    """Returns buttons that pick one of the payee or narration texts, None if there are none."""
+    if not texts:
+        return None
+    # Buttons of earlier messages can still be tapped, so they send the text
+    # itself where it fits, the others its index among the last ones of the kind
+    if not isinstance(user_data.get("suggestions"), dict):
+        # Conversations persisted before held a single list
+        user_data["suggestions"] = {}
+    user_data["suggestions"][kind] = texts
+    keyboard = []
+    for i, text in enumerate(texts):
+        data = f"{SUGGESTION_PREFIX}{kind}:{text}"
+        if len(data.encode()) > CALLBACK_DATA_BYTES:
+            data = f"{SUGGESTION_PREFIX}{kind}#{i}"
+        keyboard.append([InlineKeyboardButton(text, callback_data=data)])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def entered_text(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str
+) -> str:
+    """Returns the text typed by the user, or the suggestion of the kind they picked."""
+    query = update.callback_query
+    if query is None:
+        return update.message.text
+
+    await answer_callback_query(query)
+    data = query.data.removeprefix(f"{SUGGESTION_PREFIX}{kind}")
+    if data.startswith(":"):
+        return data[1:]
+    return context.user_data["suggestions"][kind][int(data[1:])]
+
+
+def usual_first(options, usual):
+    """Returns keyboard rows for the options, the usual one first and starred."""
+    options = sorted(options, key=lambda option: option != usual)
+    return [
+        [
+            InlineKeyboardButton(
+                f"★ {option}" if option == usual else option,
+                callback_data=f"{option}",
+            )
+        ]
+        for option in options
+    ]
+
+
 async def enter_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message is None or update.message.from_user is None:
         logger.warn(f"Update has no message")
@@ -147,11 +371,11 @@ async def select_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
     context.user_data["amount"] = update.message.text
 
-    all_counterparties = get_counterparties()
-    all_types = list(all_counterparties.keys())
-    all_types.sort()
+    # Most used first
+    _, all_counterparties = await get_choices()
     keyboard = [
-        [InlineKeyboardButton(type, callback_data=f"{type}")] for type in all_types
+        [InlineKeyboardButton(type, callback_data=f"{type}")]
+        for type in all_counterparties
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     # Send message with text and appended InlineKeyboard
@@ -174,14 +398,20 @@ async def enter_narration(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
 
     query = update.callback_query
-    await query.answer()
+    await answer_callback_query(query)
 
     context.user_data["type"] = query.data
 
+    suggestions = await get_suggestions()
+    keyboard = suggestions and suggestion_keyboard(
+        context.user_data,
+        "narration",
+        suggestions.complete("narration", "", SUGGESTION_COUNT),
+    )
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="Enter the narration",
-        reply_markup=ForceReply(input_field_placeholder="Buying Condoms"),
+        text="Enter the narration" + (", or pick a recent one" if keyboard else ""),
+        reply_markup=keyboard or ForceReply(input_field_placeholder="Buying Condoms"),
     )
 
     return ENTER_PAYEE
@@ -189,19 +419,25 @@ async def enter_narration(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def enter_payee(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if (
-        update.message is None
+        (update.message is None and update.callback_query is None)
         or context.user_data is None
         or update.effective_chat is None
     ):
         logger.warn(f"Update has no message")
         return ConversationHandler.END
 
-    context.user_data["narration"] = update.message.text
+    context.user_data["narration"] = await entered_text(update, context, "narration")
 
+    suggestions = await get_suggestions()
+    keyboard = suggestions and suggestion_keyboard(
+        context.user_data,
+        "payee",
+        suggestions.payees_for(context.user_data["narration"], SUGGESTION_COUNT),
+    )
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="Enter the payee",
-        reply_markup=ForceReply(input_field_placeholder="ALBERT HEIJN"),
+        text="Enter the payee" + (", or pick a usual one" if keyboard else ""),
+        reply_markup=keyboard or ForceReply(input_field_placeholder="ALBERT HEIJN"),
     )
 
     return SELECT_DATE
@@ -210,9 +446,9 @@ async def enter_payee(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Get user that sent /start and log his name
     if (
-        update.message is None
-        or update.message.from_user is None
+        (update.message is None and update.callback_query is None)
         or context.user_data is None
+        or update.effective_chat is None
     ):
         logger.warn(f"Update has no message")
         return ConversationHandler.END
@@ -221,7 +457,7 @@ async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     date_strs = [date.strftime("%m-%d") for date in dates]
     date_strs.sort()
 
-    context.user_data["payee"] = update.message.text
+    context.user_data["payee"] = await entered_text(update, context, "payee")
 
     keyboard = [
         [
@@ -231,7 +467,11 @@ async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     # Send message with text and appended InlineKeyboard
-    await update.message.reply_text("Select a date", reply_markup=reply_markup)
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="Select a date",
+        reply_markup=reply_markup,
+    )
     # Tell ConversationHandler that we're in state `FIRST` now
     return SELECT_COUNTERPARTY
 
@@ -246,11 +486,11 @@ async def select_counterparty(
         return ConversationHandler.END
 
     query = update.callback_query
-    await query.answer()
+    await answer_callback_query(query)
 
     context.user_data["date"] = query.data
 
-    all_counterparties = get_counterparties()
+    _, all_counterparties = await get_choices()
 
     if context.user_data["type"] not in all_counterparties:
         await query.edit_message_text("Invalid type")
@@ -258,11 +498,20 @@ async def select_counterparty(
 
     options = all_counterparties[context.user_data["type"]]
 
-    keyboard = [
-        [InlineKeyboardButton(category, callback_data=f"{category}")]
-        for category in options
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # What the payee (or narration) usually goes with is offered first
+    usual_counterparty, usual_account = None, None
+    suggestions = await get_suggestions()
+    if suggestions is not None:
+        usual_counterparty, usual_account = suggestions.usual(
+            context.user_data["payee"], context.user_data["narration"]
+        )
+    context.user_data["usual_account"] = usual_account
+    if usual_counterparty is not None and context.user_data["type"] != "Transfer":
+        usual_counterparty = usual_counterparty.removeprefix(
+            f"{context.user_data['type']}:"
+        )
+
+    reply_markup = InlineKeyboardMarkup(usual_first(options, usual_counterparty))
     # Send message with text and appended InlineKeyboard
     await query.edit_message_text("Select a counterparty", reply_markup=reply_markup)
     # Tell ConversationHandler that we're in state `FIRST` now
@@ -282,14 +531,13 @@ async def select_account_handler(
         return ConversationHandler.END
 
     query = update.callback_query
-    await query.answer()
+    await answer_callback_query(query)
 
     context.user_data["counterparty"] = query.data
-    keyboard = [
-        [InlineKeyboardButton(account, callback_data=f"{account}")]
-        for account in get_accounts()
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    accounts, _ = await get_choices()
+    reply_markup = InlineKeyboardMarkup(
+        usual_first(accounts, context.user_data.get("usual_account"))
+    )
     await query.edit_message_text(text="Select an account", reply_markup=reply_markup)
     return SUMMARY
 
@@ -322,6 +570,53 @@ def user_data_to_entry(user_data: dict) -> str:
     return new_entry
 
 
+def duplicate_key(transaction):
+    """Identifies a transaction across versions of the ledger, as user_data can store it."""
+    return [str(transaction.date), transaction.payee, transaction.narration]
+
+
+def find_duplicate(index: "DuplicateIndex", user_data: dict, exclude=()):
+    """Returns a ledger transaction that the entry of the conversation may repeat."""
+    try:
+        month, day = user_data["date"].split("-")
+        date = datetime.date(datetime.datetime.now().year, int(month), int(day))
+        # The amount of the account posting, see user_data_to_entry
+        amount = Decimal(user_data["amount"])
+        if user_data["type"] != "Income":
+            amount = -amount
+    except Exception as e:
+        logger.warning(f"Skipping the duplicate check: {e}")
+        return None
+
+    payee = "" if user_data["payee"] == "." else user_data["payee"]
+    return index.find(date, user_data["account"], amount, payee, exclude=exclude)
+
+
+def check_new_duplicates(user_data: dict):
+    """
+    Returns a write_to_file check that refuses to write the entry of the
+    conversation if the ledger has a possible duplicate of it that the summary
+    did not warn about, such as one committed by another container since.
+    """
+    from duplicates import DuplicateIndex
+
+    warned = user_data.get("duplicate")
+
+    def check(ledger):
+        index = ledger.index(DuplicateIndex)
+        exclude = set()
+        while (duplicate := find_duplicate(index, user_data, exclude)) is not None:
+            if duplicate_key(duplicate) != warned:
+                raise Exception(
+                    f"Possible duplicate of {duplicate.date} "
+                    f'"{duplicate.payee or ""}" "{duplicate.narration}" '
+                    "added in the meantime, the entry was not written"
+                )
+            exclude.add(id(duplicate))
+
+    return check
+
+
 async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Returns `ConversationHandler.END`, which tells the
     ConversationHandler that the conversation is over.
@@ -336,14 +631,29 @@ async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return ConversationHandler.END
 
     query = update.callback_query
-    await query.answer()
+    await answer_callback_query(query)
 
     context.user_data["account"] = update.callback_query.data
 
     new_entry = user_data_to_entry(context.user_data)
 
+    text = f"Is the entry correct?\n<pre>{new_entry}</pre>"
+    # The ledger this container last saw, write_to_file checks the latest one
+    from duplicates import DuplicateIndex
+
+    duplicate = None
+    index = await get_index(DuplicateIndex)
+    if index is not None:
+        duplicate = find_duplicate(index, context.user_data)
+    context.user_data["duplicate"] = duplicate and duplicate_key(duplicate)
+    if duplicate is not None:
+        text += html.escape(
+            f"\nPossible duplicate of {duplicate.date} "
+            f'"{duplicate.payee or ""}" "{duplicate.narration}"'
+        )
+
     await query.edit_message_text(
-        text=f"Is the entry correct?\n<pre>{new_entry}</pre>",
+        text=text,
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(
             [
@@ -369,20 +679,45 @@ async def confirm_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return ConversationHandler.END
 
     query = update.callback_query
-    await query.answer()
 
     if query.data == "no":
+        await answer_callback_query(query)
         await query.edit_message_text(text="Entry cancelled")
         return ConversationHandler.END
 
-    await query.edit_message_text(text="Adding entry...")
     new_entry = user_data_to_entry(context.user_data)
 
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id, action=ChatAction.TYPING
+    # In batch mode entries are only collected, /commit writes them together
+    pending = context.user_data.get("pending")
+    if pending is not None:
+        await answer_callback_query(query)
+        pending.append(new_entry)
+        await query.edit_message_text(
+            text=f"Added to batch ({len(pending)} pending)\n<pre>{new_entry}</pre>\n"
+            "/add another entry, /commit to write them or /discard to drop them",
+            parse_mode="HTML",
+        )
+        return ConversationHandler.END
+
+    from beancount_file import write_to_file
+
+    # The query is answered through the API, the webhook response would only
+    # stop the button spinning after the write and the reports. The write is not
+    # idempotent, so it only starts once these went out: had it run alongside
+    # them, a failed Telegram call would leave it orphaned.
+    await asyncio.gather(
+        query.answer(),
+        query.edit_message_text(text="Adding entry..."),
+        context.bot.send_chat_action(
+            chat_id=update.effective_chat.id, action=ChatAction.TYPING
+        ),
     )
+    # The ledger written here is reused by the reports below
+    ledger = None
     try:
-        write_to_file(new_entry)
+        ledger = await write_to_file(
+            new_entry, check=check_new_duplicates(context.user_data)
+        )
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Entry added successfully",
@@ -394,11 +729,202 @@ async def confirm_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             parse_mode="HTML",
         )
 
-    await account_report(update, context)
-    await budget_report(update, context)
+    await account_report(update, context, ledger)
+    await budget_report(update, context, ledger)
     return ConversationHandler.END
 
 
+async def start_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message is None or context.user_data is None:
+        logger.warn(f"Update has no message")
+        return
+
+    pending = context.user_data.setdefault("pending", [])
+    if not pending:
+        await update.message.reply_text(
+            "Batch started, entries confirmed with /add are kept until /commit"
+        )
+        return
+
+    entries = "\n\n".join(pending)
+    await update.message.reply_text(
+        f"{len(pending)} pending entries\n<pre>{entries}</pre>",
+        parse_mode="HTML",
+    )
+
+
+async def commit_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if (
+        update.message is None
+        or context.user_data is None
+        or update.effective_chat is None
+    ):
+        logger.warn(f"Update has no message")
+        return
+
+    pending = context.user_data.get("pending")
+    if not pending:
+        await update.message.reply_text("No pending entries, start a batch with /batch")
+        return
+
+    from beancount_file import write_to_file
+
+    # All entries are validated together and committed in a single PUT
+    entries = "\n\n".join(pending)
+    # Sent before the write starts, see confirm_entry
+    await context.bot.send_chat_action(
+        chat_id=update.effective_chat.id, action=ChatAction.TYPING
+    )
+    try:
+        ledger = await write_to_file(
+            entries, message=f"Telegram bot update ({len(pending)} entries)"
+        )
+    except Exception as e:
+        # Keep the batch so that it can be fixed up or discarded
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Error writing to Beancount file:\n{str(e)}",
+            parse_mode="HTML",
+        )
+        return
+
+    del context.user_data["pending"]
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=f"{len(pending)} entries added successfully\n<pre>{entries}</pre>",
+        parse_mode="HTML",
+    )
+    await account_report(update, context, ledger)
+    await budget_report(update, context, ledger)
+
+
+async def discard_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message is None or context.user_data is None:
+        logger.warn(f"Update has no message")
+        return
+
+    pending = context.user_data.pop("pending", None) or []
+    await update.message.reply_text(f"Discarded {len(pending)} pending entries")
+
+
+async def import_statement_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if (
+        update.message is None
+        or update.message.document is None
+        or update.effective_chat is None
+    ):
+        logger.warn(f"Update has no document")
+        return
+
+    from beancount_file import write_to_file
+    from duplicates import DuplicateIndex, split_duplicates
+    from statements import import_statement
+
+    # The caption can name the ledger account of the statement
+    account = (update.message.caption or "").strip() or None
+
+    await context.bot.send_chat_action(
+        chat_id=update.effective_chat.id, action=ChatAction.TYPING
+    )
+    try:
+        file = await update.message.document.get_file()
+        statement_format, drafts = await asyncio.to_thread(
+            import_statement, file.file_path, account
+        )
+    except Exception as e:
+        await update.message.reply_text(f"Error reading statement:\n{str(e)}")
+        return
+
+    if not drafts:
+        await update.message.reply_text("No EUR transactions in this statement")
+        return
+
+    # Statements overlap, skip what an earlier import or /add already booked
+    ledger = await _fetch_ledger(update, context)
+    if ledger is None:
+        return
+    statement_drafts = drafts
+    drafts, duplicates = split_duplicates(drafts, ledger.index(DuplicateIndex))
+    if not drafts:
+        await update.message.reply_text(
+            f"All {len(duplicates)} transactions are already in the ledger"
+        )
+        return
+
+    def check(latest_ledger):
+        # The write can rebase onto a newer ledger, which may have some of the
+        # drafts already
+        new_drafts, _ = split_duplicates(
+            statement_drafts, latest_ledger.index(DuplicateIndex)
+        )
+        if len(new_drafts) < len(drafts):
+            raise Exception(
+                f"{len(drafts) - len(new_drafts)} of the transactions were added "
+                "in the meantime, nothing was imported"
+            )
+
+    # All drafts are validated together and committed in a single PUT
+    try:
+        ledger = await write_to_file(
+            "\n\n".join(draft.to_entry() for draft in drafts),
+            message=f"Import {len(drafts)} {statement_format} transactions",
+            check=check,
+        )
+    except Exception as e:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Error writing to Beancount file:\n{str(e)[:3000]}",
+        )
+        return
+
+    counts = {}
+    for draft in drafts:
+        counts[draft.counterparty] = counts.get(draft.counterparty, 0) + 1
+    uncategorized = sum(1 for draft in drafts if not draft.categorized)
+
+    table = f"Imported {len(drafts)} {statement_format} transactions\n\n"
+    table += "<pre>\n"
+    for counterparty, count in sorted(counts.items()):
+        table += f"{counterparty:<35} {count:5d}\n"
+    table += "</pre>"
+    if uncategorized:
+        table += f"{uncategorized} uncategorized transactions are flagged with !\n"
+    if duplicates:
+        table += f"{len(duplicates)} transactions already in the ledger were skipped"
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id, text=table, parse_mode="HTML"
+    )
+
+    await account_report(update, context, ledger)
+    await budget_report(update, context, ledger)
+
+
+async def complete_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answers "@bot alb" with the payees and narrations that it completes to.
+
+    Picking one sends it as a message, which the /add step waiting for text takes.
+    """
+    query = update.inline_query
+    if query is None or query.from_user.id != int(secrets["sasha_user_id"]):
+        return
+
+    suggestions = await get_suggestions()
+    results = []
+    if suggestions is not None:
+        for kind in ("payee", "narration"):
+            for text in suggestions.complete(kind, query.query, SUGGESTION_COUNT):
+                results.append(
+                    InlineQueryResultArticle(
+                        id=f"{kind}:{len(results)}",
+                        title=text,
+                        description=kind.capitalize(),
+                        input_message_content=InputTextMessageContent(text),
+                    )
+                )
+
+    await query.answer(results, cache_time=0, is_personal=True)
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Returns `ConversationHandler.END`, which tells the
     ConversationHandler that the conversation is over.
@@ -424,6 +950,9 @@ def add_handlers(app: Application):
         account_report,
         filters.User(user_id=allowed_user_ids),
     )
+    trend_handler = CommandHandler(
+        "trend", trend_report, filters.User(user_id=allowed_user_ids)
+    )
     add_handler = ConversationHandler(
         entry_points=[
             CommandHandler("add", enter_amount, filters.User(user_id=allowed_user_ids))
@@ -437,9 +966,13 @@ def add_handlers(app: Application):
             ],
             ENTER_PAYEE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, enter_payee),
+                CallbackQueryHandler(
+                    enter_payee, pattern=suggestion_pattern("narration")
+                ),
             ],
             SELECT_DATE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, select_date),
+                CallbackQueryHandler(select_date, pattern=suggestion_pattern("payee")),
             ],
             SELECT_COUNTERPARTY: [
                 CallbackQueryHandler(select_counterparty),
@@ -453,9 +986,35 @@ def add_handlers(app: Application):
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="add",
+        persistent=True,
+    )
+
+    batch_handlers = [
+        CommandHandler(command, callback, filters.User(user_id=allowed_user_ids))
+        for command, callback in (
+            ("batch", start_batch),
+            ("commit", commit_batch),
+            ("discard", discard_batch),
+        )
+    ]
+
+    statement_handler = MessageHandler(
+        filters.Document.FileExtension("csv") & filters.User(user_id=allowed_user_ids),
+        import_statement_document,
     )
 
     # Add ConversationHandler to application that will be used for handling updates
-    app.add_handlers([budget_handler, account_handler, add_handler])
+    app.add_handlers(
+        [
+            budget_handler,
+            account_handler,
+            trend_handler,
+            add_handler,
+            *batch_handlers,
+            statement_handler,
+            InlineQueryHandler(complete_inline),
+        ]
+    )
 
     return app
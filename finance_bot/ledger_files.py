@@ -0,0 +1,98 @@
+import copy
+import fnmatch
+import glob
+import os
+import posixpath
+from asyncio.log import logger
+from concurrent.futures import ProcessPoolExecutor
+
+from beancount import loader
+from beancount.core.data import entry_sortkey
+from beancount.ops import validation
+from beancount.parser import booking, parser
+
+import metrics
+
+# Processes parsing changed files in parallel, 1 to always parse in this one
+PARSE_PROCESSES = int(os.environ.get("LEDGER_PARSE_PROCESSES", os.cpu_count() or 1))
+
+
+def parse_file(path, content):
+    """Returns the entries, errors and options of a single file, includes not followed."""
+    return parser.parse_string(content, path)
+
+
+def parse_files(files):
+    """Parses (path, content) pairs, in parallel when there are several of them."""
+    if len(files) > 1 and PARSE_PROCESSES > 1:
+        try:
+            with ProcessPoolExecutor(min(PARSE_PROCESSES, len(files))) as pool:
+                return list(pool.map(parse_file, *zip(*files)))
+        except OSError as e:
+            # Lambda has no /dev/shm for the semaphores of a process pool
+            logger.warning(f"Parsing serially, no process pool: {e}")
+
+    return [parse_file(path, content) for path, content in files]
+
+
+def included_paths(path, options, repository_paths):
+    """Returns the paths of the repository that a file includes, in include order.
+
+    Includes are relative to the including file, and can be globs like the
+    loader accepts.
+    """
+    paths = []
+    for include in options["include"]:
+        pattern = posixpath.normpath(posixpath.join(posixpath.dirname(path), include))
+        if glob.has_magic(pattern):
+            paths.extend(
+                sorted(p for p in repository_paths if fnmatch.fnmatch(p, pattern))
+            )
+        elif pattern in repository_paths:
+            paths.append(pattern)
+        else:
+            raise Exception(f'Included file "{include}" not found in the repository')
+    return paths
+
+
+def load_parsed(parsed):
+    """
+    Books, transforms and validates the parsed files of a ledger like the loader
+    does, with the options of the first file.
+
+    Args:
+        parsed (list): (path, (entries, errors, options)) of each file, the top
+            one first. The parsed entries are not modified.
+
+    Returns:
+        list: The entries of the ledger.
+        dict: Its options.
+    """
+    entries, errors = [], []
+    options = None
+    for path, (file_entries, file_errors, file_options) in parsed:
+        entries.extend(file_entries)
+        errors.extend(file_errors)
+        if options is None:
+            # Aggregating mutates the options, which are shared with the parse cache
+            options = copy.deepcopy(file_options)
+        else:
+            loader.aggregate_options_map(options, file_options)
+    options["include"] = sorted(path for path, _ in parsed)
+
+    with metrics.stage("book"):
+        entries.sort(key=entry_sortkey)
+        # Booking returns new transactions, the plugins only ever see those
+        entries, booking_errors = booking.book(entries, options)
+    errors.extend(booking_errors)
+    with metrics.stage("plugins"):
+        entries, errors = loader.run_transformations(entries, errors, options, None)
+    with metrics.stage("validate"):
+        errors.extend(validation.validate(entries, options, None, None))
+
+    if errors:
+        for error in errors:
+            logger.error(error)
+        raise Exception(f"Error loading Beancount file: {errors}")
+
+    return entries, options
@@ -0,0 +1,119 @@
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+# CloudWatch namespace of the per-update metrics, nothing is recorded when unset
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE")
+
+# Metrics and properties of the update being processed. Tasks and threads
+# started while processing it get a copy of the context, so they add to the
+# same record.
+_record: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "metrics_record", default=None
+)
+
+
+def start_record(**properties):
+    """Starts recording the metrics of an update, if metrics are enabled.
+
+    Args:
+        **properties: Values logged with the metrics, such as the cold start flag.
+    """
+    if METRICS_NAMESPACE is None:
+        _record.set(None)
+        return
+
+    _record.set({"metrics": {}, "units": {}, "properties": properties})
+
+
+def put_metric(name, value, unit="Count"):
+    """Sets a metric of the current update."""
+    record = _record.get()
+    if record is None:
+        return
+
+    record["metrics"][name] = value
+    record["units"][name] = unit
+
+
+def count(name, n=1):
+    """Adds n to a count of the current update."""
+    record = _record.get()
+    if record is None:
+        return
+
+    put_metric(name, record["metrics"].get(name, 0) + n)
+
+
+def set_property(name, value):
+    """Sets a value logged with the metrics of the current update, not a metric itself."""
+    record = _record.get()
+    if record is not None:
+        record["properties"][name] = value
+
+
+# Shared by the stages of updates that are not recorded, entering it costs nothing
+_not_recorded = nullcontext()
+
+
+def stage(name):
+    """Adds the time spent in the `with` block to the `name` metric, in milliseconds.
+
+    Overlapping blocks of the same stage, like concurrent Telegram calls, are
+    added up.
+    """
+    record = _record.get()
+    if record is None:
+        return _not_recorded
+    return _timed(record, name)
+
+
+@contextmanager
+def _timed(record, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        record["metrics"][name] = record["metrics"].get(name, 0) + elapsed
+        record["units"][name] = "Milliseconds"
+
+
+def emit(dimension="Update"):
+    """Logs the metrics of the current update in the CloudWatch embedded metric format.
+
+    Args:
+        dimension (str): The property the metrics are aggregated by.
+    """
+    record = _record.get()
+    if record is None:
+        return
+    _record.set(None)
+
+    properties = record["properties"]
+    properties.setdefault(dimension, "unknown")
+    metrics = {
+        name: round(value, 3) if isinstance(value, float) else value
+        for name, value in record["metrics"].items()
+    }
+    log = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [[dimension]],
+                    "Metrics": [
+                        {"Name": name, "Unit": record["units"][name]}
+                        for name in metrics
+                    ],
+                }
+            ],
+        },
+        **properties,
+        **metrics,
+    }
+    # CloudWatch extracts the metrics from JSON lines of the function output
+    print(json.dumps(log, default=str), flush=True)
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import sqlite3
+from asyncio.log import logger
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+PERSISTENCE_TABLE = os.environ.get("PERSISTENCE_TABLE")
+PERSISTENCE_SQLITE_PATH = os.environ.get(
+    "PERSISTENCE_SQLITE_PATH", "/tmp/persistence.sqlite3"
+)
+
+
+class SqliteStore:
+    """Key-value store in a local SQLite file, for tests and local runs."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS kv "
+            "(kind TEXT, id TEXT, value TEXT, PRIMARY KEY (kind, id))"
+        )
+        self.connection.commit()
+
+    def get(self, kind, id):
+        row = self.connection.execute(
+            "SELECT value FROM kv WHERE kind = ? AND id = ?", (kind, id)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def get_all(self, kind):
+        rows = self.connection.execute(
+            "SELECT id, value FROM kv WHERE kind = ?", (kind,)
+        )
+        return dict(rows.fetchall())
+
+    def put(self, kind, id, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO kv (kind, id, value) VALUES (?, ?, ?)",
+            (kind, id, value),
+        )
+        self.connection.commit()
+
+    def delete(self, kind, id):
+        self.connection.execute("DELETE FROM kv WHERE kind = ? AND id = ?", (kind, id))
+        self.connection.commit()
+
+
+class DynamoDBStore:
+    """Key-value store in a DynamoDB table with a `kind` hash key and an `id` range key."""
+
+    def __init__(self, table_name):
+        # boto3 ships with the Lambda runtime, only import it when it is used
+        import boto3
+
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, kind, id):
+        item = self.table.get_item(
+            Key={"kind": kind, "id": id}, ConsistentRead=True
+        ).get("Item")
+        return None if item is None else item["value"]
+
+    def get_all(self, kind):
+        from boto3.dynamodb.conditions import Key
+
+        values = {}
+        query = {
+            "KeyConditionExpression": Key("kind").eq(kind),
+            "ConsistentRead": True,
+        }
+        while True:
+            response = self.table.query(**query)
+            values.update((item["id"], item["value"]) for item in response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return values
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def put(self, kind, id, value):
+        self.table.put_item(Item={"kind": kind, "id": id, "value": value})
+
+    def delete(self, kind, id):
+        self.table.delete_item(Key={"kind": kind, "id": id})
+
+
+class KeyValuePersistence(BasePersistence):
+    """
+    Stores user data, chat data and conversation states in a key-value store,
+    one item per user, chat or conversation key, as JSON.
+
+    Only the items that changed since they were last read or written are put,
+    and user and chat data are read again before every update, so that several
+    containers can take turns in the same conversation.
+    """
+
+    def __init__(self, store, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        # (kind, id) -> the JSON last read from or written to the store
+        self._known = {}
+
+    async def _get(self, kind, id):
+        value = await asyncio.to_thread(self.store.get, kind, id)
+        self._known[(kind, id)] = value
+        return None if value is None else json.loads(value)
+
+    async def _get_all(self, kind):
+        values = await asyncio.to_thread(self.store.get_all, kind)
+        for known_kind, id in list(self._known):
+            if known_kind == kind and id not in values:
+                self._known[(kind, id)] = None
+        for id, value in values.items():
+            self._known[(kind, id)] = value
+        return {id: json.loads(value) for id, value in values.items()}
+
+    async def _put(self, kind, id, data):
+        value = json.dumps(data, sort_keys=True)
+        if self._known.get((kind, id)) == value:
+            return
+        await asyncio.to_thread(self.store.put, kind, id, value)
+        self._known[(kind, id)] = value
+
+    async def _delete(self, kind, id):
+        if (kind, id) in self._known and self._known[(kind, id)] is None:
+            return
+        await asyncio.to_thread(self.store.delete, kind, id)
+        self._known[(kind, id)] = None
+
+    async def get_user_data(self):
+        return {
+            int(id): data for id, data in (await self._get_all("user_data")).items()
+        }
+
+    async def get_chat_data(self):
+        return {
+            int(id): data for id, data in (await self._get_all("chat_data")).items()
+        }
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        conversations = await self._get_all(f"conversation:{name}")
+        return {tuple(json.loads(key)): state for key, state in conversations.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            await self._delete(f"conversation:{name}", json.dumps(key))
+        else:
+            await self._put(f"conversation:{name}", json.dumps(key), new_state)
+
+    async def update_user_data(self, user_id, data):
+        await self._put("user_data", str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._put("chat_data", str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._delete("user_data", str(user_id))
+
+    async def drop_chat_data(self, chat_id):
+        await self._delete("chat_data", str(chat_id))
+
+    async def refresh_user_data(self, user_id, user_data):
+        stored = await self._get("user_data", str(user_id))
+        user_data.clear()
+        user_data.update(stored or {})
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        stored = await self._get("chat_data", str(chat_id))
+        chat_data.clear()
+        chat_data.update(stored or {})
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # Every update is written through, nothing is buffered
+        pass
+
+
+async def refresh_conversations(application):
+    """
+    Reloads the states of the persistent conversations, which another container
+    may have moved on since this application was initialized.
+    """
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not isinstance(handler, ConversationHandler) or not handler.persistent:
+                continue
+
+            # PTB only loads the states on initialize() and has no public way to
+            # load them again, so this replaces the TrackingDict that
+            # ConversationHandler keeps them in, without marking them as changed.
+            # It is internal to python-telegram-bot, pinned to 20.4 for this in
+            # pyproject.toml: check it still exists before upgrading.
+            states = getattr(handler, "_conversations", None)
+            if not hasattr(states, "update_no_track"):
+                raise Exception(
+                    "ConversationHandler no longer keeps its states in _conversations"
+                )
+
+            conversations = await application.persistence.get_conversations(
+                handler.name
+            )
+            states.data.clear()
+            states.update_no_track(conversations)
+
+
+def make_persistence():
+    if PERSISTENCE_TABLE:
+        logger.info(f"Persisting conversations to DynamoDB table {PERSISTENCE_TABLE}")
+        return KeyValuePersistence(DynamoDBStore(PERSISTENCE_TABLE))
+
+    logger.info(f"Persisting conversations to {PERSISTENCE_SQLITE_PATH}")
+    return KeyValuePersistence(SqliteStore(PERSISTENCE_SQLITE_PATH))
@@ -1,10 +1,56 @@
+from collections import OrderedDict, defaultdict
 from decimal import Decimal
+import bisect
+import re
 import sys
-from beancount import loader
-from beancount.query import query
+from beancount.core.data import Transaction
+from beancount.core.inventory import Inventory
 from datetime import date
 import calendar
 
+import numpy as np
+
+import metrics
+
+# Telegram refuses messages longer than this
+MESSAGE_LENGTH = 4096
+
+# Rendered reports of the current ledger version, least recently used first
+REPORT_CACHE_SIZE = 32
+_report_cache = OrderedDict()
+_report_cache_version = None
+
+
+def cached_report(version, key, render):
+    """
+    Returns the report rendered for the key, calling render() only when it is not cached.
+
+    Reports of other versions of the ledger are dropped as soon as a new version
+    is asked for, such as right after a write.
+
+    Args:
+        version: The version of the ledger the report is rendered from.
+        key (tuple): Everything else the report depends on, today's date included.
+        render (callable): Renders the report.
+    """
+    global _report_cache_version
+
+    if version != _report_cache_version:
+        _report_cache.clear()
+        _report_cache_version = version
+
+    if key in _report_cache:
+        _report_cache.move_to_end(key)
+        metrics.count("report_cache_hits")
+        return _report_cache[key]
+
+    with metrics.stage("render_report"):
+        report = _report_cache[key] = render()
+    metrics.count("report_cache_misses")
+    if len(_report_cache) > REPORT_CACHE_SIZE:
+        _report_cache.popitem(last=False)
+    return report
+
 
 def get_month_end(n_months_ahead):
     today = date.today()
@@ -13,7 +59,545 @@ def get_month_end(n_months_ahead):
     return last_date
 
 
-def generate_monthly_budget_report(entries, options):
+# BQL's ~ operator is a case-insensitive regex search
+_is_budget_expense = re.compile("Expenses:", re.IGNORECASE).search
+_is_balance_account = re.compile("Assets:|Liabilities:", re.IGNORECASE).search
+
+
+def _new_budget_account(account):
+    return {
+        "assigned": Decimal(0),
+        "assigned_this_month": Decimal(0),
+        "spent": Decimal(0),
+        "spent_this_month": Decimal(0),
+        "account": account,
+    }
+
+
+def aggregate(entries, last_date, current_date):
+    """
+    Sum up the postings needed by both reports in a single pass over the transactions.
+
+    Args:
+        entries (list): A list of entries from the Beancount file.
+        last_date (date): The last day included in the budget aggregates.
+        current_date (date): The last day included in the account balances.
+
+    Returns:
+        dict: The budget accounts by name, the income available to the budget,
+        and the inventory of every asset and liability account.
+    """
+    budget_accounts = {}
+    income_available = Decimal(0)
+    balances = {}
+
+    for entry in entries:
+        if not isinstance(entry, Transaction):
+            continue
+
+        for posting in entry.postings:
+            account = posting.account
+
+            if entry.date <= current_date and _is_balance_account(account):
+                if account not in balances:
+                    balances[account] = Inventory()
+                balances[account].add_position(posting)
+
+            if entry.date > last_date:
+                continue
+
+            if account == "Income:Available":
+                income_available += posting.units.number
+                continue
+
+            if account == "Expenses:Spent" or not _is_budget_expense(account):
+                continue
+
+            if account not in budget_accounts:
+                budget_accounts[account] = _new_budget_account(account)
+
+            units = posting.units
+            if units is None or units.currency is None:
+                continue
+
+            if units.currency == "EUR":
+                budget_accounts[account]["spent"] += units.number
+                if entry.date.month == last_date.month:
+                    budget_accounts[account]["spent_this_month"] += units.number
+
+            if units.currency == "BGT_EUR" and "budget" in entry.tags:
+                budget_accounts[account]["assigned"] += units.number
+                if entry.date.month == last_date.month:
+                    budget_accounts[account]["assigned_this_month"] += units.number
+
+    return {
+        "budget_accounts": budget_accounts,
+        "income_available": income_available,
+        "balances": balances,
+    }
+
+
+class BudgetRollup:
+    """
+    Totals of the budget postings per (account, currency, budget tag) and month,
+    with prefix sums over the months so that the budget report of any month is
+    computed in O(accounts). Built once per version of the ledger and extended
+    as entries are appended to it.
+    """
+
+    def __init__(self, entries):
+        # (year, month) -> {(account, currency, budget tag): Decimal}
+        self.months = {}
+        # The first month each budget account shows up in, with or without units
+        self.first_months = {}
+        self._prefix_sums = None
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry):
+        if not isinstance(entry, Transaction):
+            return
+
+        month = (entry.date.year, entry.date.month)
+        totals = self.months.setdefault(month, defaultdict(Decimal))
+        for posting in entry.postings:
+            account = posting.account
+
+            if account == "Income:Available":
+                totals[(account, posting.units.currency, False)] += posting.units.number
+                continue
+
+            if account == "Expenses:Spent" or not _is_budget_expense(account):
+                continue
+
+            if account not in self.first_months or month < self.first_months[account]:
+                self.first_months[account] = month
+
+            units = posting.units
+            if units is None or units.currency is None:
+                continue
+
+            if units.currency == "EUR":
+                totals[(account, "EUR", False)] += units.number
+
+            if units.currency == "BGT_EUR" and "budget" in entry.tags:
+                totals[(account, "BGT_EUR", True)] += units.number
+
+        self._prefix_sums = None
+
+    def _get_prefix_sums(self):
+        if self._prefix_sums is None:
+            months = sorted(self.months)
+            running = defaultdict(Decimal)
+            sums = []
+            for month in months:
+                for key, number in self.months[month].items():
+                    running[key] += number
+                sums.append(dict(running))
+            self._prefix_sums = (months, sums)
+
+        return self._prefix_sums
+
+    def totals(self, last_date):
+        """
+        Returns the same budget accounts and income available as aggregate(),
+        for a last_date at the end of a month.
+        """
+        months, sums = self._get_prefix_sums()
+        last_month = (last_date.year, last_date.month)
+        n_months = bisect.bisect_right(months, last_month)
+        cumulative = sums[n_months - 1] if n_months else {}
+
+        budget_accounts = {
+            account: _new_budget_account(account)
+            for account, first_month in self.first_months.items()
+            if first_month <= last_month
+        }
+        income_available = Decimal(0)
+        for (account, currency, _), number in cumulative.items():
+            if account == "Income:Available":
+                income_available += number
+            elif currency == "EUR":
+                budget_accounts[account]["spent"] += number
+            else:
+                budget_accounts[account]["assigned"] += number
+
+        # Like the BQL report, "this month" matches the month of every year so far
+        for month in months[:n_months]:
+            if month[1] != last_date.month:
+                continue
+            for (account, currency, _), number in self.months[month].items():
+                if account == "Income:Available":
+                    continue
+                if currency == "EUR":
+                    budget_accounts[account]["spent_this_month"] += number
+                else:
+                    budget_accounts[account]["assigned_this_month"] += number
+
+        return budget_accounts, income_available
+
+
+def columnar_budget_totals(columns, last_date):
+    """
+    Returns the same budget accounts and income available as aggregate(), with
+    group-bys over the posting columns.
+    """
+    until_last_date = columns.day <= columns.day_number(last_date)
+    income_available, _ = columns.sum_by_account(
+        until_last_date & columns.account_mask(lambda a: a == "Income:Available")
+    )
+
+    budget = until_last_date & columns.account_mask(
+        lambda account: account != "Expenses:Spent" and _is_budget_expense(account)
+    )
+    this_month = columns.month_of_year() == last_date.month
+    spent = budget & (columns.currency == columns.currency_id("EUR"))
+    assigned = (
+        budget
+        & (columns.currency == columns.currency_id("BGT_EUR"))
+        & columns.tag_mask("budget")
+    )
+
+    _, present = columns.sum_by_account(budget)
+    sums = {
+        "spent": columns.sum_by_account(spent)[0],
+        "spent_this_month": columns.sum_by_account(spent & this_month)[0],
+        "assigned": columns.sum_by_account(assigned)[0],
+        "assigned_this_month": columns.sum_by_account(assigned & this_month)[0],
+    }
+
+    budget_accounts = {}
+    for account_id in present.nonzero()[0]:
+        account = columns.accounts[account_id]
+        budget_accounts[account] = _new_budget_account(account)
+        for name, totals in sums.items():
+            if totals[account_id]:
+                budget_accounts[account][name] += columns.to_decimal(totals[account_id])
+
+    return budget_accounts, sum(
+        (columns.to_decimal(number) for number in income_available if number),
+        Decimal(0),
+    )
+
+
+def columnar_positions(columns, current_date):
+    """
+    Returns the EUR position of each asset and liability account like
+    render_account_report() reads it from the balances of aggregate(), or None
+    if an account holds something the columns don't tell apart, like lots at
+    cost or several currencies.
+    """
+    balance = (columns.day <= columns.day_number(current_date)) & columns.account_mask(
+        _is_balance_account
+    )
+    if columns.at_cost[balance].any():
+        return None
+
+    _, present = columns.sum_by_account(balance)
+    held = {columns.accounts[account_id]: [] for account_id in present.nonzero()[0]}
+    for currency_id, currency in enumerate(columns.currencies):
+        totals, _ = columns.sum_by_account(balance & (columns.currency == currency_id))
+        for account_id in totals.nonzero()[0]:
+            held[columns.accounts[account_id]].append((currency, totals[account_id]))
+
+    positions = {}
+    for account, amounts in held.items():
+        if len(amounts) > 1:
+            # The inventory refuses to pick one of several positions
+            return None
+        position = 0
+        if amounts:
+            currency, number = amounts[0]
+            if currency != "EUR":
+                raise ValueError(f"Unknown currency: {currency}")
+            position = columns.to_decimal(number)
+        positions[account] = position
+
+    return positions
+
+
+def _is_trend_account(account):
+    return account != "Expenses:Spent" and _is_budget_expense(account)
+
+
+def monthly_trend(entries):
+    """
+    Sum up the EUR spent and the budget assigned to each budget account per month,
+    over the whole history, counted like aggregate() counts them.
+
+    Returns:
+        dict: {account: {first day of the month: {"assigned": ..., "spent": ...}}},
+        with only the months the account has postings in.
+    """
+    trend = {}
+    for entry in entries:
+        if not isinstance(entry, Transaction):
+            continue
+
+        for posting in entry.postings:
+            units = posting.units
+            if units is None or units.currency is None:
+                continue
+            if units.currency == "EUR":
+                name = "spent"
+            elif units.currency == "BGT_EUR" and "budget" in entry.tags:
+                name = "assigned"
+            else:
+                continue
+            if not _is_trend_account(posting.account):
+                continue
+
+            months = trend.setdefault(posting.account, {})
+            month = entry.date.replace(day=1)
+            if month not in months:
+                months[month] = {"assigned": Decimal(0), "spent": Decimal(0)}
+            months[month][name] += units.number
+
+    return trend
+
+
+def columnar_monthly_trend(columns):
+    """
+    Returns the same trend as monthly_trend(), with a single group-by of the
+    posting columns on (account, month, spent or assigned).
+    """
+    budget = columns.account_mask(_is_trend_account)
+    spent = budget & (columns.currency == columns.currency_id("EUR"))
+    assigned = (
+        budget
+        & (columns.currency == columns.currency_id("BGT_EUR"))
+        & columns.tag_mask("budget")
+    )
+    selected = spent | assigned
+    if not selected.any():
+        return {}
+
+    months = columns.month_numbers()[selected]
+    first_month = int(months.min())
+    n_months = int(months.max()) - first_month + 1
+    # Assigned is 0 and spent is 1 in the last axis
+    keys = (
+        columns.account[selected].astype(np.int64) * n_months + months - first_month
+    ) * 2 + spent[selected]
+    size = len(columns.accounts) * n_months * 2
+    totals = np.zeros(size, np.int64)
+    np.add.at(totals, keys, columns.number[selected])
+    present = np.bincount(keys, minlength=size) > 0
+
+    totals = totals.reshape(len(columns.accounts), n_months, 2)
+    present = present.reshape(len(columns.accounts), n_months, 2).any(axis=2)
+    trend = {}
+    for account_id, month_index in zip(*present.nonzero()):
+        month = first_month + int(month_index)
+        assigned_number, spent_number = totals[account_id, month_index]
+        trend.setdefault(columns.accounts[account_id], {})[
+            date(1970 + month // 12, month % 12 + 1, 1)
+        ] = {
+            "assigned": columns.to_decimal(assigned_number),
+            "spent": columns.to_decimal(spent_number),
+        }
+
+    return trend
+
+
+def render_budget_report(budget_accounts, income_available, last_date, filtered):
+    accounts = sorted(
+        (dict(account) for account in budget_accounts.values()),
+        key=lambda x: x["account"],
+    )
+    if filtered:
+        accounts = [
+            account
+            for account in accounts
+            if not account["account"].startswith("Expenses:Fixed:")
+            and not account["account"].startswith("Expenses:Savings:")
+        ]
+    # Iterate over the dictionary
+    for account in accounts:
+        account["account_name"] = account["account"].split(":")[2]
+        account["remaining"] = account["assigned"] - account["spent"]
+
+    table = f"Budget Report for {last_date.strftime('%B %Y')}\n\n"
+    table += "<pre>\n"
+    table += "| Account           | Assigned  | Available |\n"
+    table += "|-------------------|----------:|----------:|\n"
+    for account in accounts:
+        table += f"| {account['account_name']:<17} | {account['assigned_this_month']:9.2f} | {account['remaining']:9.2f} |\n"
+    table += "</pre>"
+    if not filtered:
+        table += f"Ready to assign: {income_available:9.2f} EUR\n"
+
+    return table
+
+
+def render_account_report(balances, current_date):
+    positions = {}
+    for account_name, balance in balances.items():
+        position = 0
+        row_position = balance.get_only_position()
+        if row_position is not None:
+            if row_position.units.currency != "EUR":
+                raise ValueError(f"Unknown currency: {row_position.units.currency}")
+            position = row_position.units.number
+
+        positions[account_name] = position
+
+    return render_positions(positions, current_date)
+
+
+def render_positions(positions, current_date):
+    accounts = [
+        {"account": account_name, "position": position}
+        for account_name, position in positions.items()
+    ]
+    accounts = sorted(accounts, key=lambda x: x["account"])
+
+    # make a table
+    table = f"Account Report for {current_date}\n\n"
+    table += "<pre>\n"
+    table += "| Account                     | € Position |\n"
+    table += "|-----------------------------|-----------:|\n"
+    for account in accounts:
+        table += f"| {account['account']:<27} | {account['position']:10.2f} |\n"
+    table += "</pre>"
+
+    return table
+
+
+def match_trend_accounts(accounts, name):
+    """
+    Returns the budget accounts that /trend shows for a name: the account with
+    that name, as in the budget report or in full, or every account under it.
+    """
+    name = name.lower()
+    matches = []
+    for account in accounts:
+        lowered = account.lower()
+        if (
+            lowered == name
+            or lowered.startswith(name + ":")
+            or lowered.split(":")[2:3] == [name]
+        ):
+            matches.append(account)
+    return matches
+
+
+def _trend_months(trend, n_months, last_month):
+    """
+    Returns the first day of each of the n_months months up to the one of
+    last_month, oldest first, or of every month since the first posting when
+    n_months is None.
+    """
+    if n_months is None:
+        first = min(
+            (month for months in trend.values() for month in months),
+            default=last_month,
+        )
+        n_months = (last_month.year - first.year) * 12 + last_month.month
+        n_months = max(n_months - first.month + 1, 1)
+
+    months = []
+    year, month = last_month.year, last_month.month
+    for _ in range(n_months):
+        months.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    months.reverse()
+    return months
+
+
+def _split_table(title, header, rows):
+    """Returns the table as messages that Telegram accepts, the header repeated in each."""
+    messages = []
+    table = f"{title}\n\n<pre>\n{header}"
+    for row in rows:
+        if len(table) + len(row) + len("</pre>") > MESSAGE_LENGTH:
+            messages.append(table + "</pre>")
+            table = f"<pre>\n{header}"
+        table += row
+    messages.append(table + "</pre>")
+    return messages
+
+
+def render_trend(trend, accounts, months):
+    """Renders the assigned and spent totals of the accounts in each of the months."""
+    rows = {month: {"assigned": Decimal(0), "spent": Decimal(0)} for month in months}
+    for account in accounts:
+        for month, totals in trend.get(account, {}).items():
+            if month in rows:
+                rows[month]["assigned"] += totals["assigned"]
+                rows[month]["spent"] += totals["spent"]
+
+    if len(accounts) == 1:
+        title = accounts[0]
+    else:
+        title = f"{len(accounts)} budget accounts"
+    header = "| Month   |  Assigned |     Spent |\n"
+    header += "|---------|----------:|----------:|\n"
+    lines = [
+        f"| {month.strftime('%Y-%m')} | {row['assigned']:9.2f} | {row['spent']:9.2f} |\n"
+        for month, row in rows.items()
+    ]
+    assigned = sum((row["assigned"] for row in rows.values()), Decimal(0))
+    spent = sum((row["spent"] for row in rows.values()), Decimal(0))
+    lines.append(
+        f"| Average | {assigned / len(months):9.2f} | {spent / len(months):9.2f} |\n"
+    )
+
+    return _split_table(
+        f"Trend of {title} since {months[0].strftime('%B %Y')}", header, lines
+    )
+
+
+def render_trend_by_account(trend, accounts, months):
+    """Renders the monthly average assigned and spent of each account over the months."""
+    window = set(months)
+    header = "| Account                   |  Assigned |     Spent |\n"
+    header += "|---------------------------|----------:|----------:|\n"
+    lines = []
+    total_assigned, total_spent = Decimal(0), Decimal(0)
+    for account in accounts:
+        assigned, spent = Decimal(0), Decimal(0)
+        for month, totals in trend.get(account, {}).items():
+            if month in window:
+                assigned += totals["assigned"]
+                spent += totals["spent"]
+        total_assigned += assigned
+        total_spent += spent
+        name = account.removeprefix("Expenses:")
+        lines.append(
+            f"| {name:<25} | {assigned / len(months):9.2f} | {spent / len(months):9.2f} |\n"
+        )
+    lines.append(
+        f"| {'Total':<25} | {total_assigned / len(months):9.2f} "
+        f"| {total_spent / len(months):9.2f} |\n"
+    )
+
+    return _split_table(
+        f"Monthly average per budget account since {months[0].strftime('%B %Y')}",
+        header,
+        lines,
+    )
+
+
+def budget_totals(entries, last_date, rollup=None, columns=None):
+    """
+    Returns the budget accounts and income available up to last_date, from the
+    fastest of the given indexes that can compute them exactly.
+    """
+    if columns is not None and columns.exact:
+        return columnar_budget_totals(columns, last_date)
+
+    # The rollup sums whole months, and get_month_end() keeps the day of the
+    # current month, which is not the end of a longer month ahead
+    _, last_day = calendar.monthrange(last_date.year, last_date.month)
+    if rollup is not None and last_date.day == last_day:
+        return rollup.totals(last_date)
+
+    aggregates = aggregate(entries, last_date, date.today())
+    return aggregates["budget_accounts"], aggregates["income_available"]
+
+
+def generate_monthly_budget_report(entries, options, rollup=None, columns=None):
     """
     Generate a monthly budget report for the current month.
     Sums up the allocated budget and the spent budget for each account based on currency and sign.
@@ -24,11 +608,143 @@ def generate_monthly_budget_report(entries, options):
         options (dict): The options from the Beancount file.
             - filtered (bool): Whether to filter out fixed and savings expenses.
             - n_months_ahead (int): The number of months to look ahead for the budget report.
+        rollup (BudgetRollup): The rollup of the entries, if one was already built.
+        columns (PostingColumns): The postings of the entries as columns, used
+            over the rollup when they hold every amount exactly.
+
+    Returns:
+        str: The report as an HTML table.
+    """
+    last_date = get_month_end(options["n_months_ahead"])
+    budget_accounts, income_available = budget_totals(
+        entries, last_date, rollup, columns
+    )
+
+    return render_budget_report(
+        budget_accounts, income_available, last_date, options["filtered"]
+    )
+
+
+def generate_account_report(entries, options, columns=None):
+    current_date = date.today()
+    if columns is not None and columns.exact:
+        positions = columnar_positions(columns, current_date)
+        if positions is not None:
+            return render_positions(positions, current_date)
+
+    aggregates = aggregate(entries, current_date, current_date)
+
+    return render_account_report(aggregates["balances"], current_date)
+
+
+def generate_trend_report(entries, options, account, n_months, columns=None):
+    """
+    Renders the assigned and spent of the budget accounts over the last n_months
+    months, or over the whole history when it is None.
+
+    Args:
+        account (str): Shows the monthly totals of the budget accounts that the name
+            matches. When None, shows the monthly average of every budget account.
+        columns (PostingColumns): The postings of the entries as columns, used
+            when they hold every amount exactly.
 
     Returns:
-        list: A list of dictionaries representing the monthly budget report.
-        Decimal: The total income assigned to the budget.
+        list: The report as HTML tables, split over as many messages as it takes.
     """
+    if columns is not None and columns.exact:
+        trend = columnar_monthly_trend(columns)
+    else:
+        trend = monthly_trend(entries)
+
+    months = _trend_months(trend, n_months, date.today())
+    accounts = sorted(trend)
+    if account is None:
+        return render_trend_by_account(trend, accounts, months)
+
+    accounts = match_trend_accounts(accounts, account)
+    if not accounts:
+        raise ValueError(f"Unknown budget account: {account}")
+    return render_trend(trend, accounts, months)
+
+
+def check_parity(entries, options):
+    """
+    Compare the reports with their BQL implementations, and the columnar trend
+    with the Decimal one, returns the mismatches.
+    """
+    from columnar import PostingColumns
+
+    mismatches = []
+    rollup = BudgetRollup(entries)
+    columns = PostingColumns(entries)
+    for n_months_ahead in range(3):
+        try:
+            get_month_end(n_months_ahead)
+        except ValueError:
+            # Not every month has as many days as the current one
+            continue
+
+        for filtered in (True, False):
+            report_options = dict(
+                options, n_months_ahead=n_months_ahead, filtered=filtered
+            )
+            expected = _bql_monthly_budget_report(entries, report_options)
+            for name, actual in (
+                ("budget", generate_monthly_budget_report(entries, report_options)),
+                (
+                    "budget rollup",
+                    generate_monthly_budget_report(entries, report_options, rollup),
+                ),
+                (
+                    "budget columns",
+                    generate_monthly_budget_report(
+                        entries, report_options, columns=columns
+                    ),
+                ),
+            ):
+                if actual != expected:
+                    mismatches.append(
+                        (
+                            f"{name} {n_months_ahead} filtered={filtered}",
+                            expected,
+                            actual,
+                        )
+                    )
+
+    # Cut-offs within a month, with postings after them in the same month
+    months = sorted({entry.date.replace(day=1) for entry in entries})
+    for month in months[-3:]:
+        last_date = month.replace(day=15)
+        expected = aggregate(entries, last_date, last_date)
+        expected = expected["budget_accounts"], expected["income_available"]
+        for name, actual in (
+            ("budget rollup", budget_totals(entries, last_date, rollup)),
+            ("budget columns", budget_totals(entries, last_date, columns=columns)),
+        ):
+            if actual != expected:
+                mismatches.append((f"{name} {last_date}", expected, actual))
+
+    expected = _bql_account_report(entries, options)
+    for name, actual in (
+        ("account", generate_account_report(entries, options)),
+        ("account columns", generate_account_report(entries, options, columns)),
+    ):
+        if actual != expected:
+            mismatches.append((name, expected, actual))
+
+    # The trend has no BQL implementation, the columns are checked against the loop
+    if columns.exact:
+        expected, actual = monthly_trend(entries), columnar_monthly_trend(columns)
+        if actual != expected:
+            mismatches.append(("trend columns", expected, actual))
+
+    return mismatches
+
+
+def _bql_monthly_budget_report(entries, options):
+    """BQL implementation of generate_monthly_budget_report, kept to check parity."""
+    from beancount.query import query
+
     last_date = get_month_end(options["n_months_ahead"])
 
     # Query for budget allocations
@@ -99,7 +815,10 @@ def generate_monthly_budget_report(entries, options):
     return table
 
 
-def generate_account_report(entries, options):
+def _bql_account_report(entries, options):
+    """BQL implementation of generate_account_report, kept to check parity."""
+    from beancount.query import query
+
     current_date = date.today()
 
     # Query for budget allocations
@@ -136,6 +855,8 @@ def generate_account_report(entries, options):
 
 
 def main():
+    from beancount import loader
+
     filename = "main.beancount"
     entries, errors, options = loader.load_file(filename, log_errors=sys.stderr)
 
@@ -151,6 +872,19 @@ def main():
     elif report_type == "account":
         report = generate_account_report(entries, options)
         print(report)
+
+    elif report_type == "trend":
+        account = sys.argv[2] if len(sys.argv) > 2 else None
+        report = generate_trend_report(entries, options, account, 12)
+        print("\n".join(report))
+
+    elif report_type == "parity":
+        mismatches = check_parity(entries, options)
+        for name, expected, actual in mismatches:
+            print(f"{name} differs from BQL:\n{expected}\n{actual}")
+        if mismatches:
+            sys.exit(1)
+        print("Reports match BQL")
     else:
         raise ValueError(f"Unknown report type: {report_type}")
 
@@ -0,0 +1,167 @@
+import csv
+import datetime
+import re
+from dataclasses import dataclass
+from decimal import Decimal
+import httpx
+
+from constants import (
+    UNCATEGORIZED_ACCOUNT,
+    UNCATEGORIZED_INCOME_ACCOUNT,
+    get_category_rules,
+    get_statement_accounts,
+)
+
+DOWNLOAD_TIMEOUT = httpx.Timeout(20.0, connect=3.0)
+
+
+@dataclass(slots=True)
+class Draft:
+    """A transaction read from a bank statement, from the point of view of the bank account."""
+
+    date: datetime.date
+    amount: Decimal
+    payee: str
+    narration: str
+    account: str
+    # Defaults to the uncategorized account of the side of the amount
+    counterparty: str | None = None
+    categorized: bool = False
+
+    def __post_init__(self):
+        if self.counterparty is None:
+            self.counterparty = (
+                UNCATEGORIZED_INCOME_ACCOUNT
+                if self.amount > 0
+                else UNCATEGORIZED_ACCOUNT
+            )
+
+    def to_entry(self):
+        # Uncategorized drafts are flagged so that they stand out in the ledger
+        flag = "*" if self.categorized else "!"
+        payee = self.payee.replace('"', "'")
+        narration = self.narration.replace('"', "'")
+
+        entry = f'{self.date} {flag} "{payee}" "{narration}"\n'
+        entry += f"    {self.counterparty} {-self.amount} EUR\n"
+        entry += f"    {self.account}"
+        return entry
+
+
+def _dutch_number(text):
+    return Decimal(text.replace(".", "").replace(",", "."))
+
+
+def _ing_rows(rows, account):
+    for row in rows:
+        amount = _dutch_number(row["Bedrag (EUR)"])
+        if row["Af Bij"] == "Af":
+            amount = -amount
+        yield Draft(
+            # YYYYMMDD, much faster than strptime
+            date=datetime.date.fromisoformat(row["Datum"]),
+            amount=amount,
+            payee=row["Naam / Omschrijving"].strip(),
+            narration=row["Mededelingen"].strip(),
+            account=account,
+        )
+
+
+def _wise_rows(rows, account):
+    for row in rows:
+        # Other currencies live in their own balances
+        if row["Currency"] != "EUR":
+            continue
+        yield Draft(
+            date=datetime.datetime.strptime(row["Date"], "%d-%m-%Y").date(),
+            amount=Decimal(row["Amount"]),
+            payee=(
+                row.get("Merchant")
+                or row.get("Payee Name")
+                or row.get("Payer Name")
+                or ""
+            ).strip(),
+            narration=row["Description"].strip(),
+            account=account,
+        )
+
+
+def _amex_rows(rows, account):
+    for row in rows:
+        # Charges are positive on the statement and grow the liability
+        yield Draft(
+            date=datetime.datetime.strptime(row["Datum"], "%m/%d/%Y").date(),
+            amount=-_dutch_number(row["Bedrag"]),
+            payee=row["Omschrijving"].strip(),
+            narration="",
+            account=account,
+        )
+
+
+# Format name -> (columns that identify it, row parser)
+FORMATS = {
+    "ING": ({"Datum", "Naam / Omschrijving", "Af Bij", "Bedrag (EUR)"}, _ing_rows),
+    "WISE": ({"TransferWise ID", "Date", "Amount", "Currency"}, _wise_rows),
+    "AMEX": ({"Datum", "Omschrijving", "Bedrag"}, _amex_rows),
+}
+
+
+def detect_format(header):
+    columns = {column.strip().lstrip("\ufeff") for column in header}
+    for name, (required_columns, _) in FORMATS.items():
+        if required_columns <= columns:
+            return name
+    raise ValueError(f"Unknown statement format with columns {sorted(columns)}")
+
+
+def categorize(draft, rules):
+    text = f"{draft.payee} {draft.narration}"
+    for pattern, counterparty in rules:
+        if pattern.search(text):
+            draft.counterparty = counterparty
+            draft.categorized = True
+            break
+    return draft
+
+
+def read_statement(lines, account=None):
+    """
+    Turn the lines of a bank statement CSV into categorized drafts, one row at a time.
+
+    Args:
+        lines (iterable): The lines of the CSV, read lazily.
+        account (str): The ledger account of the statement, defaults to the one of its format.
+
+    Returns:
+        str: The detected format.
+        generator: The drafts, in the order of the statement.
+    """
+    lines = iter(lines)
+    first_line = next(lines).lstrip("\ufeff")
+    # Only the delimiter differs between banks, quoting is the usual doubled quotes
+    delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    header = next(csv.reader([first_line], delimiter=delimiter))
+    format = detect_format(header)
+
+    rules = [
+        (re.compile(pattern, re.IGNORECASE), counterparty)
+        for pattern, counterparty in get_category_rules()
+    ]
+    rows = csv.DictReader(
+        lines, fieldnames=[column.strip() for column in header], delimiter=delimiter
+    )
+    drafts = FORMATS[format][1](rows, account or get_statement_accounts()[format])
+    return format, (categorize(draft, rules) for draft in drafts)
+
+
+def import_statement(url, account=None):
+    """
+    Stream a statement from a URL and return its format and drafts.
+
+    Only the drafts are kept in memory, the file itself is read line by line.
+    Meant to run in a worker thread.
+    """
+    with httpx.stream("GET", url, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        format, drafts = read_statement(response.iter_lines(), account)
+        return format, list(drafts)
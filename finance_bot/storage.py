@@ -0,0 +1,237 @@
+import asyncio
+import base64
+import json
+import os
+import shutil
+from asyncio.log import logger
+
+import github_client
+
+# Bytes of the file per base64 chunk of a PUT body, a multiple of 3 so that the
+# chunks concatenate into the base64 of the whole file
+BASE64_CHUNK = 3 * 256 * 1024
+
+
+class _ContentsBody:
+    """
+    The JSON body of a contents API PUT, with the file base64-encoded chunk by
+    chunk while it is sent instead of as one more copy of the whole file.
+
+    Iterable again, so that the request can be retried.
+    """
+
+    def __init__(self, data, **fields):
+        self.data = data
+        # The content goes last, so the other fields are written once around it
+        self.prefix = json.dumps(fields)[:-1].encode() + b', "content": "'
+        self.suffix = b'"}'
+
+    def __len__(self):
+        return len(self.prefix) + 4 * -(-len(self.data) // 3) + len(self.suffix)
+
+    async def __aiter__(self):
+        yield self.prefix
+        view = memoryview(self.data)
+        for start in range(0, len(view), BASE64_CHUNK):
+            yield base64.b64encode(view[start : start + BASE64_CHUNK])
+        yield self.suffix
+
+
+class RestStorage:
+    """The ledger files through the GitHub git data and contents APIs."""
+
+    def __init__(self, repository_url, branch):
+        self.repository_url = repository_url
+        self.branch = branch
+
+    async def get_tree(self, etag=None):
+        """Returns the blob SHA of every file of the branch, or None if the ETag still matches."""
+        headers = {}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+
+        response = await github_client.request(
+            "GET",
+            f"{self.repository_url}/git/trees/{self.branch}",
+            params={"recursive": "1"},
+            headers=headers,
+        )
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        files = {
+            item["path"]: item["sha"]
+            for item in response.json()["tree"]
+            if item["type"] == "blob"
+        }
+        return {"etag": response.headers.get("ETag"), "files": files}
+
+    async def get_blob(self, path, sha):
+        """Returns the content of a file.
+
+        The blob is downloaded as is with the raw media type, which has no 1 MB
+        limit, instead of base64 inside JSON.
+        """
+        response = await github_client.request(
+            "GET",
+            f"{self.repository_url}/git/blobs/{sha}",
+            stream=True,
+            headers={"Accept": "application/vnd.github.raw"},
+        )
+        try:
+            response.raise_for_status()
+            data = bytearray()
+            async for chunk in response.aiter_bytes():
+                data += chunk
+        finally:
+            await response.aclose()
+
+        return data.decode("utf-8")
+
+    async def put_file(self, path, content, sha, message):
+        """Commits the content over the version of the file with the given blob SHA.
+
+        Returns the blob SHA of the new version, or None if the file changed since.
+        """
+        body = _ContentsBody(
+            content.encode(), message=message, sha=sha, branch=self.branch
+        )
+        response = await github_client.request(
+            "PUT",
+            f"{self.repository_url}/contents/{path}",
+            idempotent=False,
+            content=body,
+            headers={
+                "Content-Type": "application/json",
+                "Content-Length": str(len(body)),
+            },
+        )
+        if response.status_code == 409:
+            return None
+        response.raise_for_status()
+        return response.json()["content"]["sha"]
+
+
+class GitStorage:
+    """
+    The ledger files in a shallow clone of their repository, kept in /tmp for
+    the life of the container.
+
+    Warm reads only fetch the commits pushed since the last one, and there is no
+    limit on the size of the files. Writes are a local commit and a push, which
+    is rejected like a conflicting PUT when the branch moved on.
+    """
+
+    def __init__(self, remote_url, branch, directory):
+        self.remote_url = remote_url
+        self.branch = branch
+        self.directory = directory
+        # Reads and writes move the working tree, one at a time
+        self.lock = asyncio.Lock()
+
+    async def _git(self, *args, check=True):
+        # The token is sent as a header so that it is never written to .git/config
+        credentials = base64.b64encode(
+            f"x-access-token:{github_client.GITHUB_TOKEN}".encode()
+        ).decode()
+        process = await asyncio.create_subprocess_exec(
+            "git",
+            "-c",
+            f"http.extraHeader=Authorization: Basic {credentials}",
+            "-c",
+            "user.name=Finance Bot",
+            "-c",
+            "user.email=finance-bot@users.noreply.github.com",
+            *args,
+            cwd=self.directory if os.path.isdir(self.directory) else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # The Lambda home directory is read-only
+            env={**os.environ, "HOME": "/tmp", "GIT_TERMINAL_PROMPT": "0"},
+        )
+        stdout, stderr = await process.communicate()
+        if check and process.returncode != 0:
+            raise Exception(f"git {args[0]} failed: {stderr.decode().strip()}")
+        return process.returncode, stdout, stderr.decode()
+
+    async def _rev_parse(self, revision):
+        _, stdout, _ = await self._git("rev-parse", revision)
+        return stdout.decode().strip()
+
+    async def _sync(self):
+        """Moves the clone to the latest commit of the branch."""
+        if not os.path.isdir(os.path.join(self.directory, ".git")):
+            # Left over by a clone that did not finish
+            shutil.rmtree(self.directory, ignore_errors=True)
+            await self._git(
+                "clone",
+                "--depth=1",
+                "--single-branch",
+                f"--branch={self.branch}",
+                self.remote_url,
+                self.directory,
+            )
+            return
+
+        await self._git("fetch", "--depth=1", "origin", self.branch)
+        await self._git("reset", "--hard", "--quiet", "FETCH_HEAD")
+
+    async def get_tree(self, etag=None):
+        """Returns the blob SHA of every file of the branch, or None if the commit is unchanged."""
+        async with self.lock:
+            await self._sync()
+
+            commit = await self._rev_parse("HEAD")
+            if commit == etag:
+                return None
+            # The blob SHAs are the ones the GitHub API reports for the same files
+            _, stdout, _ = await self._git("ls-tree", "-r", "-z", "HEAD")
+
+        files = {}
+        for line in stdout.decode().split("\0"):
+            if not line:
+                continue
+            info, path = line.split("\t", 1)
+            _, type, sha = info.split()
+            if type == "blob":
+                files[path] = sha
+        return {"etag": commit, "files": files}
+
+    async def get_blob(self, path, sha):
+        """Returns the content of a file."""
+        _, stdout, _ = await self._git("cat-file", "blob", sha)
+        return stdout.decode("utf-8")
+
+    async def put_file(self, path, content, sha, message):
+        """Commits the content over the version of the file with the given blob SHA and pushes it.
+
+        Returns the blob SHA of the new version, or None if the file changed since.
+        """
+        async with self.lock:
+            if await self._rev_parse(f"HEAD:{path}") != sha:
+                return None
+
+            with open(
+                os.path.join(self.directory, path),
+                "w",
+                encoding="utf-8",
+                newline="",
+            ) as f:
+                f.write(content)
+            await self._git("commit", "--quiet", "-m", message, "--", path)
+
+            returncode, _, stderr = await self._git(
+                "push", "origin", f"HEAD:refs/heads/{self.branch}", check=False
+            )
+            if returncode != 0:
+                # Drop the local commit, the next read starts from the remote again
+                await self._git("reset", "--hard", "--quiet", "HEAD~1")
+                # Not a fast-forward, as opposed to "[remote rejected]" for hooks
+                # or branch protection that no retry gets past
+                if "[rejected]" in stderr:
+                    logger.warning(f"Push to {self.branch} rejected, it moved on")
+                    return None
+                raise Exception(f"git push failed: {stderr.strip()}")
+
+            return await self._rev_parse(f"HEAD:{path}")
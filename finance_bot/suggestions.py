@@ -0,0 +1,250 @@
+import bisect
+import datetime
+import heapq
+
+from beancount.core.data import Transaction
+
+from duplicates import normalize_payee
+
+# A use of a payee or narration counts half as much as one this many days later
+RECENCY_HALF_LIFE_DAYS = 180
+_RECENCY_EPOCH = datetime.date(2000, 1, 1)
+
+# Prefixes matching more words than this keep their best texts ready, the
+# others are ranked by scanning their matches
+SCAN_LIMIT = 256
+# How many of the best texts are kept for those prefixes
+TOP_COUNT = 12
+
+KINDS = ("payee", "narration")
+
+
+def _weight(date):
+    # Grows with the date instead of decaying with age, so that a score only
+    # ever increases as newer entries come in
+    return 2 ** ((date - _RECENCY_EPOCH).days / RECENCY_HALF_LIFE_DAYS)
+
+
+def _word_suffixes(key):
+    """Yields the key from the start of each of its words."""
+    start = 0
+    while True:
+        yield key[start:]
+        start = key.find(" ", start) + 1
+        if start == 0:
+            return
+
+
+def _split_postings(entry):
+    """
+    Returns the counterparty and the account of a transaction as /add picks them,
+    the account being the Assets or Liabilities side that pays. None if the
+    transaction does not post to Assets or Liabilities, like budget assignments.
+    """
+    balance_postings, other_postings = [], []
+    for posting in entry.postings:
+        if posting.account.startswith(("Assets:", "Liabilities:")):
+            balance_postings.append(posting)
+        else:
+            other_postings.append(posting)
+
+    if not balance_postings:
+        return None
+    if other_postings:
+        return other_postings[0].account, balance_postings[0].account
+    if len(balance_postings) == 2:
+        # A transfer, from the account whose balance goes down
+        to, account = sorted(
+            balance_postings,
+            key=lambda posting: posting.units.number if posting.units else 0,
+            reverse=True,
+        )
+        return to.account, account.account
+    return None
+
+
+class _Text:
+    __slots__ = ("text", "score", "usual", "payees")
+
+    def __init__(self):
+        self.text = None
+        self.score = 0.0
+        # (counterparty, account) -> weight of the transactions that posted to them
+        self.usual = {}
+        # Normalized payee -> weight of the transactions with it, for narrations
+        self.payees = {}
+
+
+class SuggestionIndex:
+    """
+    Payees and narrations of the ledger, ranked by how often and how recently they
+    were used, for completing the free text steps of /add.
+
+    The normalized texts of each kind are in a sorted array of (word, text) pairs,
+    so that the texts with a word starting with a prefix are a range found by
+    bisection. Prefixes with a large range, the short ones, keep their TOP_COUNT
+    best texts, so that no lookup scans more than SCAN_LIMIT words. Entries
+    appended to the ledger are added in place.
+    """
+
+    def __init__(self, entries):
+        self.texts = {kind: {} for kind in KINDS}
+        weights = {}
+        normalized = {}
+        for entry in entries:
+            if type(entry) is not Transaction:
+                continue
+            if entry.date not in weights:
+                weights[entry.date] = _weight(entry.date)
+            for value in (entry.payee, entry.narration):
+                if value not in normalized:
+                    normalized[value] = normalize_payee(value)
+            self._count(
+                entry,
+                weights[entry.date],
+                normalized[entry.payee],
+                normalized[entry.narration],
+            )
+
+        self.words = {
+            kind: sorted((word, key) for key in texts for word in _word_suffixes(key))
+            for kind, texts in self.texts.items()
+        }
+        # Prefix -> its best keys, best first
+        self.tops = {kind: {} for kind in KINDS}
+        for kind in KINDS:
+            self._build_tops(kind, "", 0, len(self.words[kind]))
+
+    def _rank(self, kind):
+        texts = self.texts[kind]
+        return lambda key: (-texts[key].score, key)
+
+    def _build_tops(self, kind, prefix, start, end):
+        """Returns the best keys of the words[start:end] starting with the prefix."""
+        words = self.words[kind]
+        if end - start <= SCAN_LIMIT:
+            keys = {key for _, key in words[start:end]}
+            return heapq.nsmallest(TOP_COUNT, keys, key=self._rank(kind))
+
+        # The best keys of the prefix are among the best of each longer prefix,
+        # and of the words that are the prefix itself, which sort first
+        candidates = set()
+        depth = len(prefix)
+        i = start
+        while i < end and len(words[i][0]) == depth:
+            candidates.add(words[i][1])
+            i += 1
+        while i < end:
+            child = words[i][0][: depth + 1]
+            child_end = bisect.bisect_left(words, (child + "\uffff",), i, end)
+            candidates.update(self._build_tops(kind, child, i, child_end))
+            i = child_end
+
+        top = heapq.nsmallest(TOP_COUNT, candidates, key=self._rank(kind))
+        self.tops[kind][prefix] = top
+        return top
+
+    def _count(self, entry, weight, payee, narration):
+        """Adds a transaction to the stats, returns the (kind, key, is new) it changed."""
+        usual = _split_postings(entry)
+        if usual is None:
+            return []
+
+        changed = []
+        for kind, value, key in (
+            ("payee", entry.payee, payee),
+            ("narration", entry.narration, narration),
+        ):
+            if not key:
+                continue
+
+            text = self.texts[kind].get(key)
+            changed.append((kind, key, text is None))
+            if text is None:
+                text = self.texts[kind][key] = _Text()
+
+            # The latest spelling is the one shown
+            text.text = value
+            text.score += weight
+            text.usual[usual] = text.usual.get(usual, 0) + weight
+            if kind == "narration" and payee:
+                text.payees[payee] = text.payees.get(payee, 0) + weight
+        return changed
+
+    def append(self, entry):
+        if type(entry) is not Transaction:
+            return
+
+        changed = self._count(
+            entry,
+            _weight(entry.date),
+            normalize_payee(entry.payee),
+            normalize_payee(entry.narration),
+        )
+        for kind, key, is_new in changed:
+            tops = self.tops[kind]
+            rank = self._rank(kind)
+            for word in _word_suffixes(key):
+                if is_new:
+                    bisect.insort(self.words[kind], (word, key))
+                # Scores only go up, so a kept list only ever gains this key
+                for length in range(len(word) + 1):
+                    top = tops.get(word[:length])
+                    if top is None:
+                        continue
+                    if key not in top:
+                        top.append(key)
+                    top.sort(key=rank)
+                    del top[TOP_COUNT:]
+
+    def complete(self, kind, prefix="", limit=6):
+        """
+        Returns the best ranked payees or narrations with a word starting with the prefix.
+
+        Args:
+            kind (str): "payee" or "narration".
+            prefix (str): What was typed so far, empty for the best overall.
+            limit (int): The number of texts to return at most.
+
+        Returns:
+            list: The texts as last written in the ledger, best first.
+        """
+        prefix = normalize_payee(prefix)
+        texts = self.texts[kind]
+        top = self.tops[kind].get(prefix)
+        if top is not None and limit <= TOP_COUNT:
+            keys = top[:limit]
+        else:
+            words = self.words[kind]
+            start = bisect.bisect_left(words, (prefix,))
+            end = bisect.bisect_left(words, (prefix + "\uffff",), start)
+            keys = {key for _, key in words[start:end]}
+            keys = heapq.nsmallest(limit, keys, key=self._rank(kind))
+        return [texts[key].text for key in keys]
+
+    def payees_for(self, narration, limit=6):
+        """Returns the payees most used with the narration, then the best overall."""
+        text = self.texts["narration"].get(normalize_payee(narration))
+        payees = []
+        if text is not None:
+            payees = [
+                self.texts["payee"][key].text
+                for key in heapq.nlargest(limit, text.payees, key=text.payees.get)
+            ]
+        for payee in self.complete("payee", "", 2 * limit):
+            if len(payees) == limit:
+                break
+            if payee not in payees:
+                payees.append(payee)
+        return payees
+
+    def usual(self, payee, narration=""):
+        """
+        Returns the counterparty and account most used together with the payee,
+        or with the narration for unknown or empty payees, or (None, None).
+        """
+        for kind, value in (("payee", payee), ("narration", narration)):
+            text = self.texts[kind].get(normalize_payee(value))
+            if text is not None:
+                return max(text.usual, key=text.usual.get)
+        return None, None
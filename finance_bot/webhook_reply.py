@@ -0,0 +1,32 @@
+import contextvars
+
+# The Bot API call to return in the webhook response of the update being processed,
+# which Telegram then makes itself without another round trip from the bot
+_reply: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "webhook_reply", default=None
+)
+
+
+def start_reply():
+    """Lets the handlers of the update about to be processed defer one call to the response.
+
+    Returns:
+        dict: The method and parameters of the deferred call, empty if there is none.
+    """
+    reply = {}
+    _reply.set(reply)
+    return reply
+
+
+async def answer_callback_query(query):
+    """Answers a callback query in the webhook response if it is free, or right away.
+
+    The response only goes out when the handler returns, handlers that take
+    longer than a Telegram call, like writing the ledger, answer right away.
+    """
+    reply = _reply.get()
+    if reply is not None and not reply:
+        reply.update(method="answerCallbackQuery", callback_query_id=query.id)
+        return
+
+    await query.answer()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The bot modules import each other as top-level modules, like in the Lambda
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "finance_bot"))
+# The synthetic ledgers of the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks"))
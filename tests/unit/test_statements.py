@@ -0,0 +1,116 @@
+import datetime
+import os
+import re
+from decimal import Decimal
+
+import pytest
+
+from constants import (
+    UNCATEGORIZED_ACCOUNT,
+    UNCATEGORIZED_INCOME_ACCOUNT,
+    get_category_rules,
+)
+from statements import Draft, categorize, read_statement
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name, account=None):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as lines:
+        format, drafts = read_statement(lines, account)
+        return format, list(drafts)
+
+
+def test_ing_semicolons_decimal_comma_and_af_bij():
+    format, drafts = read_fixture("ing.csv")
+
+    assert format == "ING"
+    assert [(draft.date, draft.amount) for draft in drafts] == [
+        (datetime.date(2024, 1, 5), Decimal("-1234.56")),
+        (datetime.date(2024, 1, 25), Decimal("3000.00")),
+        (datetime.date(2024, 1, 31), Decimal("-2.95")),
+    ]
+    assert drafts[0].payee == "ALBERT HEIJN 1403"
+    assert drafts[1].narration == "Salaris januari"
+    assert {draft.account for draft in drafts} == {"Assets:NL:ING:Checking59"}
+
+
+def test_wise_commas_signed_amounts_and_other_currencies():
+    format, drafts = read_fixture("wise.csv")
+
+    assert format == "WISE"
+    # The USD row lives in another balance
+    assert [(draft.date, draft.amount, draft.payee) for draft in drafts] == [
+        (datetime.date(2024, 2, 3), Decimal("-4.20"), "COFFEE COMPANY"),
+        (datetime.date(2024, 2, 5), Decimal("250.00"), "A Friend"),
+        (datetime.date(2024, 2, 7), Decimal("-12.00"), "UBER *TRIP"),
+    ]
+    assert {draft.account for draft in drafts} == {"Assets:BE:WISE:Checking"}
+
+
+def test_amex_bom_us_dates_and_positive_charges():
+    format, drafts = read_fixture("amex.csv", account="Liabilities:NL:AMEX:Other")
+
+    assert format == "AMEX"
+    # Charges grow the liability, payments to the card shrink it
+    assert [(draft.date, draft.amount) for draft in drafts] == [
+        (datetime.date(2024, 2, 10), Decimal("-45.00")),
+        (datetime.date(2024, 2, 12), Decimal("-23.10")),
+        (datetime.date(2024, 2, 20), Decimal("1500.00")),
+    ]
+    assert {draft.account for draft in drafts} == {"Liabilities:NL:AMEX:Other"}
+
+
+def test_rules_categorize_on_whole_words():
+    _, ing = read_fixture("ing.csv")
+    _, wise = read_fixture("wise.csv")
+    _, amex = read_fixture("amex.csv")
+
+    counterparties = [
+        (draft.payee, draft.counterparty, draft.categorized)
+        for draft in ing + wise + amex
+    ]
+    assert counterparties == [
+        ("ALBERT HEIJN 1403", "Expenses:Variable:Groceries", True),
+        ("FUNG BV", UNCATEGORIZED_INCOME_ACCOUNT, False),
+        ("ING BANK", "Expenses:Variable:BankFees", True),
+        # Neither FEE nor CAFE, as parts of a word
+        ("COFFEE COMPANY", UNCATEGORIZED_ACCOUNT, False),
+        ("A Friend", UNCATEGORIZED_INCOME_ACCOUNT, False),
+        ("UBER *TRIP", "Expenses:Variable:Transport", True),
+        # Not PLUS
+        ("SURPLUS OUTLET AMSTERDAM", UNCATEGORIZED_ACCOUNT, False),
+        ("THUISBEZORGD.NL", "Expenses:Variable:EatOut", True),
+        ("HARTELIJK BEDANKT VOOR UW BETALING", UNCATEGORIZED_INCOME_ACCOUNT, False),
+    ]
+
+
+def test_rules_first_match_wins():
+    rules = [
+        (re.compile(pattern, re.IGNORECASE), counterparty)
+        for pattern, counterparty in get_category_rules()
+    ]
+    draft = Draft(
+        date=datetime.date(2024, 1, 1),
+        amount=Decimal("-20.00"),
+        payee="Uber Eats",
+        narration="",
+        account="Assets:NL:ING:Checking59",
+    )
+
+    assert categorize(draft, rules).counterparty == "Expenses:Variable:EatOut"
+
+
+def test_uncategorized_credit_entry_is_income():
+    _, drafts = read_fixture("ing.csv")
+
+    assert drafts[1].to_entry() == (
+        '2024-01-25 ! "FUNG BV" "Salaris januari"\n'
+        f"    {UNCATEGORIZED_INCOME_ACCOUNT} -3000.00 EUR\n"
+        "    Assets:NL:ING:Checking59"
+    )
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError, match="Unknown statement format"):
+        read_statement(["Date,Description,Value", "2024-01-01,x,1"])